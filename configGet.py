@@ -10,22 +10,42 @@ __status__     = "Development"
 __date__       = "12.10.2023"
 
 import os
-import subprocess
+import socket
 import json
 
+CONFIG_FILE = '/usr/local/bin/hetznerdns/config.json'
+STATUS_SOCKET = '/usr/local/bin/hetznerdns/status.sock'
+
 # Function to read the configuration file
 def read_config():
     config = {}
     try:
-        with open('/usr/local/bin/hetznerdns/config.json', 'r') as config_file:
+        with open(CONFIG_FILE, 'r') as config_file:
             config = json.load(config_file)
     except FileNotFoundError:
         error_message = {"error": "Config file not found."}
         return error_message
     return config
 
-# Function to check if the service is running
+# Ask the running daemon for its status; None if it doesn't answer
+def read_status(socket_path, timeout=1.0):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            data = b""
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        return json.loads(data.decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+# Function to check if the service is running; only needed if the daemon doesn't answer
 def is_service_running():
+    import subprocess
     try:
         # Use systemctl to check if the service is active
         result = subprocess.run(['systemctl', 'is-active', 'hetznerDnsUpdate.service'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
@@ -36,11 +56,22 @@ def is_service_running():
 
 if __name__ == "__main__":
     config = read_config()
-    
-    if "error" in config:
+
+    # The running daemon knows everything; this avoids starting systemctl
+    status = read_status(config.get("statusSocket", STATUS_SOCKET)) if "error" not in config else None
+
+    if status is not None:
+        # The daemon doesn't hand out the API token; show its first 5 characters from the config
+        first = dict(config, **config["targets"][0]) if config.get("targets") else config
+        status["apiToken"] = first.get("apiToken", "")[:5] + "..."
+        print(json.dumps(status, indent=4))
+    elif "error" in config:
         print(json.dumps(config, indent=4))
     else:
         service_running = is_service_running()
+        # With several watch targets the page shows the first one
+        if config.get("targets"):
+            config = dict(config, **config["targets"][0])
         # Truncate the API token to the first 5 characters
         truncated_token = config.get("apiToken", "")[:5]
 
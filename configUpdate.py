@@ -35,9 +35,13 @@ def update_config(api_token, directory):
         with open('/usr/local/bin/hetznerdns/config.json', 'r') as config_file:
             config = json.load(config_file)
 
-        # Update the values
-        config['apiToken'] = api_token
-        config['directory'] = directory
+        # Update the values; with several watch targets the page manages the first one
+        if config.get('targets'):
+            config['targets'][0]['apiToken'] = api_token
+            config['targets'][0]['directory'] = directory
+        else:
+            config['apiToken'] = api_token
+            config['directory'] = directory
 
         # Write the updated configuration back to the file
         with open('/usr/local/bin/hetznerdns/config.json', 'w') as config_file:
@@ -6,8 +6,36 @@ if ( !isset( $include_path ) )
     exit( );
 }
 
-$strConfig = shell_exec('/usr/local/bin/hetznerdns/configGet.py');
-$objConfig = json_decode($strConfig);
+// The status socket of the daemon; "statusSocket" in config.json like configGet.py reads it ("" = off)
+$strStatusSocket = '/usr/local/bin/hetznerdns/status.sock';
+$strConfigFile = @file_get_contents('/usr/local/bin/hetznerdns/config.json');
+if ($strConfigFile !== false) {
+  $objConfigFile = json_decode($strConfigFile);
+  if (is_object($objConfigFile) && property_exists($objConfigFile, 'statusSocket')) {
+    $strStatusSocket = (string)$objConfigFile->statusSocket;
+  }
+}
+
+// Ask the running daemon first; only start configGet.py if it doesn't answer
+$objConfig = null;
+$objSocket = $strStatusSocket !== '' ? @stream_socket_client('unix://' . $strStatusSocket, $intErrno, $strError, 1) : false;
+if ($objSocket !== false) {
+  stream_set_timeout($objSocket, 1);
+  $objConfig = json_decode(stream_get_contents($objSocket));
+  fclose($objSocket);
+
+  // The daemon doesn't hand out the API token; show its first 5 characters from the config (of the first target)
+  if (is_object($objConfig) && isset($objConfigFile) && is_object($objConfigFile)) {
+    $objTokenConfig = (property_exists($objConfigFile, 'targets') && is_array($objConfigFile->targets) && count($objConfigFile->targets) > 0
+                       && property_exists($objConfigFile->targets[0], 'apiToken')) ? $objConfigFile->targets[0] : $objConfigFile;
+    $objConfig->apiToken = property_exists($objTokenConfig, 'apiToken') ? substr((string)$objTokenConfig->apiToken, 0, 5) . '...' : '';
+  }
+}
+
+if (!is_object($objConfig)) {
+  $strConfig = shell_exec('/usr/local/bin/hetznerdns/configGet.py');
+  $objConfig = json_decode($strConfig);
+}
 
 /*$objFileHandler = fopen('/usr/local/bin/hetznerdns/config.json', 'r');
 
@@ -13,36 +13,115 @@ import os
 import logging
 import time
 import sys
+import signal
 import fcntl
 import atexit
 import json
-from watchdog.observers import Observer
+import argparse
 from modules.db_manager import DBManager
+from modules.metrics import MetricsServer, PENDING_EVENTS, QUEUED_JOBS
+from modules.migration import Migration
 from modules.observer_handler import ObserverHandler
+from modules.status_server import StatusServer
+from modules.event_recorder import EventRecorder
+from modules.tracing import Tracer
+from modules.watch_target import WatchTarget, create_client
 
-observer_started = False
+# Set by SIGHUP; the main loop reloads the configuration
+reload_requested = False
 
-# Function to load the configuration from the JSON file
-def load_config(filename, logger=None):
+# Default values for all settings which are missing in the configuration file.
+# Several directories and Hetzner accounts can be watched with a list of targets; every target
+# takes the settings it doesn't set itself from the top level:
+#   { "targets": [ { "name": "reseller1", "apiToken": "...", "directory": "/var/named/", "workers": 2 }, ... ] }
+DEFAULT_CONFIG = {
+    # Directory to watch over
+    "directory": "/var/named/",
+    # Shell patterns of the zone files to synchronize and to leave out, e.g. ["customer-*.db"]
+    "include": [],
+    "exclude": [],
+    # Authentication Token for the Hetzner API
+    "apiToken": "",
+    # Base URL of the Hetzner DNS API; only changed for tests against a local server
+    "apiUrl": "https://dns.hetzner.com/api/v1",
+    # Seconds between two full reconciliations of the directory
+    "reconcileInterval": 3600,
+    # Seconds a zone file must be quiet before it will be synchronized
+    "debounceSeconds": 2,
+    # Number of keep-alive connections to the Hetzner API
+    "poolSize": 10,
+    # Timeouts in seconds for connecting to and reading from the Hetzner API
+    "connectTimeout": 5,
+    "readTimeout": 30,
+    # Retries with exponential backoff on rate limiting (429) and server errors (5xx)
+    "maxRetries": 3,
+    "backoffFactor": 0.5,
+    # Send the zone imports gzip compressed; turned off automatically if the API refuses it
+    "compressUploads": False,
+    # Number of zones which are uploaded in parallel
+    "workers": 4,
+    # Requests per second to the Hetzner API over all workers and the allowed burst
+    "rateLimit": 5,
+    "rateBurst": 10,
+    # Failed uploads are retried after this many seconds, doubled on every attempt up to the maximum
+    "retryBaseDelay": 60,
+    "retryMaxDelay": 3600,
+    # Seconds in which the verifier compares every zone once with its records at Hetzner (0 = off)
+    # and the maximum of its requests per minute; it only runs while there are no other syncs
+    "verifyCyclePeriod": 86400,
+    "verifyMaxRequests": 10,
+    # Local port (0 = off) and/or unix socket ("" = off) for the metrics in the Prometheus text format
+    "metricsPort": 0,
+    "metricsSocket": "",
+    # JSON log with one span per zone sync ("" = off); summarise it with tools/trace_summary.py
+    "traceLog": "",
+    # Trace of every file system event of the watchers ("" = off); replay it with tools/replay_events.py
+    "eventTrace": "",
+    # "watchdog" or "inotify"; inotify only reports finished writes of zone files (Linux only)
+    "watcherBackend": "watchdog",
+    # Unix socket answering status requests of configGet.py and the CWP page ("" = off)
+    "statusSocket": "/usr/local/bin/hetznerdns/status.sock"
+}
+
+# Function to load the configuration from the JSON file; without exit_on_error None is returned on errors
+def load_config(filename, logger=None, exit_on_error=True):
     my_logger = logger if logger else logging.getLogger("hetznerDnsUpdate")
     if not os.path.exists(filename):
-        my_logger.error("Configuration file '{}' doesn't exist. Script will be stopped")
+        my_logger.error(f"Configuration file '{filename}' doesn't exist.")
+        if not exit_on_error:
+            return None
+        my_logger.error("Script will be stopped")
         sys.exit(1)
 
     try:
         with open(filename, 'r') as config_file:
-            # Reading the configuration file
-            config = json.load(config_file)
-            # Directory to watch over
-            directory = config.get('directory', '/var/named/')
-            # Authentication Token for the Hetzner API
-            api_token = config.get('apiToken', '')
-
-            return directory, api_token
-    except json.JSONDecodeError as e:
+            # Reading the configuration file and fill up the missing settings
+            config = dict(DEFAULT_CONFIG)
+            config.update(json.load(config_file))
+
+            return config
+    except (OSError, json.JSONDecodeError) as e:
         my_logger.error(f"Error loading configuration: {str(e)}")
+        if not exit_on_error:
+            return None
         sys.exit(1)
 
+# The watch targets of the configuration as dict name => settings. Without a "targets" list the
+# top level is the only target; its name is "", so the database of older versions stays valid.
+# A target without a name is named after its directory.
+def target_configs(config):
+    if "targets" not in config:
+        return {"": config}
+
+    shared = {key: value for key, value in config.items() if key != "targets"}
+    targets = {}
+    for target in config["targets"]:
+        target_config = dict(shared)
+        target_config.update(target)
+        name = target.get("name")
+        targets[str(name if name is not None else target_config["directory"])] = target_config
+    return targets
+
 # Check if the authentication API token is present
 def check_auth_api_token(api_token, logger=None):
     my_logger = logger if logger else logging.getLogger("hetznerDnsUpdate")  
@@ -64,18 +143,137 @@ def remove_lock_file(lock_file, logger=None):
 
     try:
         lock_file.close()
-        os.remove("dnsUpdate.lock")
+        os.remove(lock_file.name)
     except Exception as e:
         my_logger.error(f"Erro during deleten lock file: {str(e)}")
 
-def stop_observer(observer):
-    global observer_started
-    if observer_started:
-        my_observer.stop()
-        my_observer.join()
+# Status of the running daemon for the status socket; the fields of the first target are
+# kept at the top level for the CWP page, the counts are the sums of all targets
+def get_status(targets, start_time):
+    target_status = [target.status() for target in targets.values()]
+    first = target_status[0] if target_status else {}
+    sync_times = [status["lastSync"] for status in target_status if status["lastSync"]]
+    scan_times = [status["lastScan"] for status in target_status if status["lastScan"]]
+
+    return {
+        "active": True,
+        "directory": first.get("directory", ""),
+        "watcherBackend": first.get("watcherBackend", ""),
+        "workers": first.get("workers"),
+        "reconcileInterval": first.get("reconcileInterval"),
+        "startTime": start_time,
+        "zoneFiles": sum(status["zoneFiles"] for status in target_status),
+        "zones": sum(status["zones"] for status in target_status),
+        "pendingEvents": sum(status["pendingEvents"] for status in target_status),
+        "queuedJobs": sum(status["queuedJobs"] for status in target_status),
+        "lastSync": max(sync_times) if sync_times else None,
+        "lastScan": min(scan_times) if scan_times else None,
+        "targets": target_status
+    }
+
+def request_reload(signum, frame):
+    global reload_requested
+    reload_requested = True
+
+# Reload config.json after a SIGHUP. Every target takes over its new settings, new targets are
+# started and removed ones stopped (their waiting retries stay in the database).
+def reload_config(config_file_path, targets, db_manager, tracer, recorder=None, logger=None):
+    my_logger = logger if logger else logging.getLogger("hetznerDnsUpdate")
+
+    new_config = load_config(config_file_path, my_logger, exit_on_error=False)
+    if new_config is None:
+        my_logger.error("Reload failed, keeping the current configuration")
+        return
+    new_targets = target_configs(new_config)
+
+    for name, target_config in new_targets.items():
+        if target_config['apiToken'] == "":
+            my_logger.error(f"Reload failed, the API token of target '{name}' is missing")
+            return
+        if not os.path.isdir(target_config['directory']):
+            my_logger.error(f"Reload failed, the directory '{target_config['directory']}' doesn't exist")
+            return
+
+    for name in list(targets):
+        if name not in new_targets:
+            my_logger.info(f"Stopping target '{name}'")
+            targets.pop(name).stop()
+
+    for name, target_config in new_targets.items():
+        if name in targets:
+            targets[name].reload(target_config)
+        else:
+            my_logger.info(f"Starting target '{name}'")
+            targets[name] = WatchTarget(name, target_config, db_manager, tracer, recorder)
+            targets[name].start()
+
+    my_logger.info("Configuration reloaded")
+
+def stop_targets(targets):
+    for target in list(targets.values()):
+        target.stop()
+
+# One-shot synchronization of all zone files of every target (or only of --target) and exit,
+# e.g. to onboard a server with thousands of zones; see modules/migration.py. Returns the exit code.
+def migrate(args, config, db_manager, logger=None):
+    my_logger = logger if logger else logging.getLogger("hetznerDnsUpdate")
+
+    targets = target_configs(config)
+    if args.target is not None:
+        if args.target not in targets:
+            print(f"Unknown target '{args.target}', the targets are: {', '.join(repr(name) for name in targets)}", file=sys.stderr)
+            return 2
+        targets = {args.target: targets[args.target]}
+
+    success = True
+    for name, target_config in targets.items():
+        target_config = dict(target_config)
+        if args.workers:
+            # Every worker needs its own connection
+            target_config['workers'] = args.workers
+            target_config['poolSize'] = max(int(target_config['poolSize']), args.workers)
+
+        print(f"Target '{name}': {target_config['directory']}" if name else target_config['directory'])
+        handler = ObserverHandler(db_manager.for_target(name), create_client(target_config, target=name), target_config['directory'],
+                                  workers=int(target_config['workers']),
+                                  retry_base_delay=float(target_config['retryBaseDelay']),
+                                  retry_max_delay=float(target_config['retryMaxDelay']),
+                                  include=target_config.get('include'),
+                                  exclude=target_config.get('exclude'))
+        migration = Migration(handler)
+
+        try:
+            if args.dry_run:
+                migration.print_plan(args.list)
+                continue
+
+            handler.scheduler.start()
+            try:
+                success = migration.run(args.progress_interval) and success
+            finally:
+                handler.scheduler.stop()
+                handler.scheduler.join()
+        except KeyboardInterrupt:
+            my_logger.info("Migration interrupted")
+            return 130
+        finally:
+            handler.hetzner_dns.close()
+
+    return 0 if success else 1
 
 # The main part starts here
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchronizes the zone files of CWP with the Hetzner DNS; runs as daemon without a command")
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser("migrate", help="synchronize all zone files once and exit, e.g. to onboard a server; "
+                                                           "an interrupted run continues where it stopped")
+    migrate_parser.add_argument("--target", help="only the target with this name (default: all targets)")
+    migrate_parser.add_argument("--workers", type=int, default=0, help="zones uploaded in parallel (default: workers of config.json)")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="only show what would be synchronized")
+    migrate_parser.add_argument("--list", action="store_true", help="list every zone file of the dry run")
+    migrate_parser.add_argument("--progress-interval", type=float, default=5, help="seconds between two progress lines")
+    args = parser.parse_args()
+
     # Path to the directory where the script is located
     script_directory = os.path.dirname(os.path.abspath(__file__))
 
@@ -86,48 +284,97 @@ if __name__ == "__main__":
                         format='%(asctime)s - %(name)s - %(levelname)s: %(message)s')
 
     my_logger = logging.getLogger("hetznerDnsUpdate")
-    
-    lock_file = open("dnsUpdate.lock", "w")
-    try:
-        fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
-    except IOError:
-         my_logger.error("Another instance is already running.")
-         sys.exit(1)
 
-    # Create an Observer that monitors the directory
-    my_observer = Observer()
-    
-    atexit.register(stop_observer, my_observer)
-    atexit.register(remove_lock_file, lock_file)
+    # A command shows its errors on the console, too
+    if args.command:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.WARNING)
+        logging.getLogger().addHandler(console_handler)
+
+    # The dry run only reads; it may run next to the daemon
+    if not (args.command == "migrate" and args.dry_run):
+        # Next to the script, so a start from another working directory finds the same lock
+        lock_file = open(os.path.join(script_directory, "dnsUpdate.lock"), "w")
+        try:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+             my_logger.error("Another instance is already running.")
+             sys.exit(1)
+
+        atexit.register(remove_lock_file, lock_file)
     
     # Load the configuration from the JSON file
     config_file_path = os.path.join(script_directory, 'config.json')  # Path and file name to the config file in the script directory
-    named_directory, auth_api_token = load_config(config_file_path)
+    config = load_config(config_file_path)
 
-    # Check if the authentication API token is set
-    check_auth_api_token(auth_api_token, my_logger)
+    for target_config in target_configs(config).values():
+        # Check if the authentication API token is set
+        check_auth_api_token(target_config['apiToken'], my_logger)
 
-    # Check if the directory exists
-    check_directory(named_directory, my_logger)
+        # Check if the directory exists
+        check_directory(target_config['directory'], my_logger)
 
     # Create an instance of the DBManager class with file path to the database
     db_file_path = os.path.join(script_directory, 'file_info.db')  # Pfad zur Datenbankdatei im Skriptverzeichnis
 
-    my_db_manager = DBManager(db_file_path)
+    if args.command == "migrate" and args.dry_run:
+        # The dry run neither creates nor migrates the tables of the running daemon
+        my_db_manager = DBManager(db_file_path, read_only=True)
+    else:
+        my_db_manager = DBManager(db_file_path)
 
-    # Create the table if it doesn't exist
-    my_db_manager.create_table()
-    
-    # Configure and start the observer
-    my_observer_handler = ObserverHandler(my_db_manager, auth_api_token, named_directory, my_observer)
-    my_observer.schedule(my_observer_handler, path=named_directory, recursive=False)
-    
-    # my_observer.schedule(ObserverHandler(my_db_manager, auth_api_token, named_directory, my_observer), path=named_directory, recursive=False)
-    my_observer.start()
-    observer_started = True
+        # Create the table if it doesn't exist
+        my_db_manager.create_table()
+
+    if args.command == "migrate":
+        sys.exit(migrate(args, config, my_db_manager, my_logger))
+
+    # One target per watched directory and Hetzner account; each one gets its own API client,
+    # workers and reconciliation, they only share the database, the trace log and the event trace
+    my_tracer = Tracer(config['traceLog'])
+    my_recorder = EventRecorder(config['eventTrace'])
+    my_targets = {name: WatchTarget(name, target_config, my_db_manager, my_tracer, my_recorder)
+                  for name, target_config in target_configs(config).items()}
+
+    # Serve the metrics if configured
+    PENDING_EVENTS.set_function(lambda: sum(target.handler.scheduler.pending_count() for target in list(my_targets.values())))
+    QUEUED_JOBS.set_function(lambda: sum(target.db_manager.count_jobs() for target in list(my_targets.values())))
+    if config['metricsPort'] or config['metricsSocket']:
+        my_metrics_server = MetricsServer(int(config['metricsPort']), config['metricsSocket'])
+        my_metrics_server.start()
+        atexit.register(my_metrics_server.stop)
+
+    # Answer the status requests of the CWP page
+    if config['statusSocket']:
+        start_time = time.time()
+        my_status_server = StatusServer(config['statusSocket'], lambda: get_status(my_targets, start_time))
+        if my_status_server.start():
+            atexit.register(my_status_server.stop)
+
+    # Reload the configuration on "systemctl reload" (SIGHUP) or when config.json was changed,
+    # e.g. by configUpdate.py which isn't allowed to signal the service
+    signal.signal(signal.SIGHUP, request_reload)
+    config_mtime = os.stat(config_file_path).st_mtime_ns
+
+    # Every target catches up with the changes while the daemon was stopped (only files with another
+    # modification time than in the database are synchronized) and reconciles periodically by itself
+    atexit.register(stop_targets, my_targets)
+    for target in my_targets.values():
+        target.start()
 
     try:
         while True:
             time.sleep(5)  # Adjust the monitoring interval here
+
+            try:
+                if os.stat(config_file_path).st_mtime_ns != config_mtime:
+                    reload_requested = True
+            except OSError:
+                pass
+
+            if reload_requested:
+                reload_requested = False
+                config_mtime = os.stat(config_file_path).st_mtime_ns if os.path.exists(config_file_path) else config_mtime
+                reload_config(config_file_path, my_targets, my_db_manager, my_tracer, my_recorder, my_logger)
     except KeyboardInterrupt:
         exit()
@@ -45,6 +45,19 @@ files=(
     "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/db_manager.py /usr/local/bin/hetznerdns/modules/db_manager.py"
     "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/hetzner_dns.py /usr/local/bin/hetznerdns/modules/hetzner_dns.py"
     "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/observer_handler.py /usr/local/bin/hetznerdns/modules/observer_handler.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/sync_scheduler.py /usr/local/bin/hetznerdns/modules/sync_scheduler.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/rate_limiter.py /usr/local/bin/hetznerdns/modules/rate_limiter.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/zone_file.py /usr/local/bin/hetznerdns/modules/zone_file.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/job_dispatcher.py /usr/local/bin/hetznerdns/modules/job_dispatcher.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/metrics.py /usr/local/bin/hetznerdns/modules/metrics.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/tracing.py /usr/local/bin/hetznerdns/modules/tracing.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/zone_scanner.py /usr/local/bin/hetznerdns/modules/zone_scanner.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/inotify_watcher.py /usr/local/bin/hetznerdns/modules/inotify_watcher.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/status_server.py /usr/local/bin/hetznerdns/modules/status_server.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/drift_verifier.py /usr/local/bin/hetznerdns/modules/drift_verifier.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/watch_target.py /usr/local/bin/hetznerdns/modules/watch_target.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/event_recorder.py /usr/local/bin/hetznerdns/modules/event_recorder.py"
+    "https://raw.githubusercontent.com/Maker-Hub-De/CWP7-DNS-Hetzner-Update/main/modules/migration.py /usr/local/bin/hetznerdns/modules/migration.py"
 )
 
 # Download the files
@@ -61,6 +74,19 @@ sudo chmod 700 /usr/local/bin/hetznerdns/modules/__init__.py
 sudo chmod 700 /usr/local/bin/hetznerdns/modules/db_manager.py
 sudo chmod 700 /usr/local/bin/hetznerdns/modules/hetzner_dns.py
 sudo chmod 700 /usr/local/bin/hetznerdns/modules/observer_handler.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/sync_scheduler.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/rate_limiter.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/zone_file.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/job_dispatcher.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/metrics.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/tracing.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/zone_scanner.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/inotify_watcher.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/status_server.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/drift_verifier.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/watch_target.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/event_recorder.py
+sudo chmod 700 /usr/local/bin/hetznerdns/modules/migration.py
 
 # Add service user
 sudo useradd -r -M -s /sbin/nologin hetznerdnsuser
@@ -9,24 +9,58 @@ __status__     = "Development"
 __date__       = "12.10.2023"
 
 import os
+import copy
+import json
 import sqlite3
 import logging
+import threading
+from urllib.parse import quote
+from contextlib import contextmanager
+from modules.metrics import DB_DURATION
+
+# Columns of the tables besides the target; the first one is the key within a target
+TABLES = {
+    "file_info": ["filename TEXT", "last_modified INTEGER", "last_checked INTEGER", "zone_id TEXT", "digest TEXT"],
+    "zone_snapshot": ["filename TEXT", "records TEXT"],
+    "sync_jobs": ["filename TEXT", "operation TEXT", "attempts INTEGER", "next_run REAL", "last_error TEXT"],
+    "scan_checkpoint": ["directory TEXT", "generation INTEGER", "identity TEXT", "last_scan REAL"]
+}
+
+# Every row belongs to a watch target (one Hetzner account); the target "" is the
+# single directory of the old configuration format
+def table_definition(table):
+    columns = TABLES[table]
+    key = columns[0].split()[0]
+    return f"target TEXT NOT NULL DEFAULT '', {', '.join(columns)}, PRIMARY KEY (target, {key})"
 
 class DBManager:
-    def __init__(self, db_filename, logger=None):
+    def __init__(self, db_filename, read_only=False, logger=None):
         # Use an absolute path to the SQLite database file
         self.db_filename = os.path.abspath(db_filename)
+        # A read-only manager never writes the file, e.g. for a dry run next to the daemon
+        self.read_only = read_only
         self.logger = logger if logger else logging.getLogger("DBManager")
+        # All queries only see the rows of this target; see for_target
+        self.target = ""
+        # Views of other targets share the connection but must not close it
+        self.owns_connection = True
 
         # Check if the database file already exists; if not, create it
         if not os.path.exists(self.db_filename):
-            self.create_db_file()
+            if not self.read_only:
+                self.create_db_file()
         else:
             self.logger.info(f"Database file '{self.db_filename}' found")
 
+        # One connection for the whole runtime; it is shared by the worker threads, so every access is locked
+        self.lock = threading.RLock()
+        # Depth of nested transactions; while a transaction is open the single statements don't commit
+        self.transaction_depth = 0
+        self.open_connection()
+
     def __del__(self):
         try:
-            if hasattr(self, 'conn'):
+            if self.owns_connection and hasattr(self, 'conn'):
                 self.conn.close()
         except sqlite3.Error as e:
             self.logger.error(f"Error closing the database connection: {str(e)}")
@@ -39,89 +73,486 @@ class DBManager:
             self.logger.error(f"Error creating database file: {str(e)}")
             exit()  # Exit the program
 
+    def open_connection(self):
+        if self.read_only:
+            self.open_read_only()
+            return
+
+        try:
+            self.conn = sqlite3.connect(self.db_filename, check_same_thread=False)
+            # With the write-ahead log readers don't block the writer and a commit needs no
+            # fsync of the database file; NORMAL is safe in WAL mode (only the last commits
+            # may be lost on a power failure, the database can't get corrupted)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error opening the database connection: {str(e)}")
+            exit()  # Exit the program
+
+    # Work on a copy of the database in memory; the file is only read. The tables of the copy are
+    # created and migrated like the ones of the file, so a database of an older version gives
+    # the same answers as after the update. A missing database is an empty one.
+    def open_read_only(self):
+        try:
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            if os.path.exists(self.db_filename):
+                source = sqlite3.connect(f"file:{quote(self.db_filename)}?mode=ro", uri=True)
+                try:
+                    source.backup(self.conn)
+                finally:
+                    source.close()
+            else:
+                self.logger.info(f"Database file '{self.db_filename}' not found, using an empty one")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error opening the database connection: {str(e)}")
+            exit()  # Exit the program
+
+        self.create_table()
+
+    # The same database for another watch target; connection and lock are shared
+    def for_target(self, target):
+        view = copy.copy(self)
+        view.target = target
+        view.owns_connection = False
+        view.transaction_depth = 0
+        view.logger = logging.getLogger(f"DBManager.{target}") if target else self.logger
+        return view
+
+    def close(self):
+        if not self.owns_connection:
+            return
+        with self.lock:
+            try:
+                self.conn.close()
+            except sqlite3.Error as e:
+                self.logger.error(f"Error closing the database connection: {str(e)}")
+
+    # Commit the last statement unless it belongs to an open transaction
+    def commit(self):
+        if self.transaction_depth == 0:
+            self.conn.commit()
+
+    # Group several changes into one commit:
+    #   with db_manager.transaction():
+    #       db_manager.update_file_info(...)
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                try:
+                    self.conn.commit()
+                except sqlite3.Error as e:
+                    self.logger.error(f"Error committing the transaction: {str(e)}")
+
     def create_table(self):
         try:
-            with sqlite3.connect(self.db_filename) as conn:
-                cursor = conn.cursor()
+            with self.lock:
+                cursor = self.conn.cursor()
                 # Check if the table already exists
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_info'")
                 table_exists = cursor.fetchone()
 
                 if not table_exists:
                     # Create table
-                    cursor.execute('''
-                        CREATE TABLE file_info (
-                            filename TEXT PRIMARY KEY,
-                            last_modified INTEGER,
-                            last_checked INTEGER
-                        )
-                    ''')
-                    conn.commit()
+                    cursor.execute(f"CREATE TABLE file_info ({table_definition('file_info')})")
+                    self.commit()
                     self.logger.info("Table file_info created")
                 else:
                     self.logger.info("Table file_info exists")
         except sqlite3.Error as e:
             self.logger.error(f"Error creating table: {str(e)}")
 
-    def insert_file_info(self, filename, last_modified, last_checked):
+        self.migrate_table()
+        self.create_snapshot_table()
+        self.create_job_table()
+        self.create_checkpoint_table()
+        for table in TABLES:
+            self.migrate_target(table)
+
+    # The records of the last successful upload of a zone; needed to send only the changed records
+    def create_snapshot_table(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS zone_snapshot ({table_definition('zone_snapshot')})")
+                self.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error creating table zone_snapshot: {str(e)}")
+
+    # Outbound jobs which failed and will be retried; they survive a restart of the daemon
+    def create_job_table(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS sync_jobs ({table_definition('sync_jobs')})")
+                self.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error creating table sync_jobs: {str(e)}")
+
+    # State of the last full scan per watched directory. The generation is raised whenever the
+    # directory itself was replaced (other device or inode); the stored mtimes are worthless then.
+    def create_checkpoint_table(self):
         try:
-            conn = sqlite3.connect(self.db_filename)
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO file_info (filename, last_modified, last_checked) VALUES (?, ?, ?)", (filename, last_modified, last_checked))
-            conn.commit()
-            conn.close()
-            return True
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS scan_checkpoint ({table_definition('scan_checkpoint')})")
+                self.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error creating table scan_checkpoint: {str(e)}")
+
+    # Add the columns which are missing in databases created by older versions
+    def migrate_table(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("PRAGMA table_info(file_info)")
+                columns = [row[1] for row in cursor.fetchall()]
+
+                for column, column_type in [('zone_id', 'TEXT'), ('digest', 'TEXT')]:
+                    if column not in columns:
+                        cursor.execute(f"ALTER TABLE file_info ADD COLUMN {column} {column_type}")
+                        self.commit()
+                        self.logger.info(f"Column {column} added to table file_info")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error migrating table: {str(e)}")
+
+    # Tables of older versions have no target column; SQLite can't change the primary key,
+    # so the table is copied into a new one. The old rows belong to the target "".
+    def migrate_target(self, table):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute(f"PRAGMA table_info({table})")
+                columns = [row[1] for row in cursor.fetchall()]
+                if 'target' in columns:
+                    return
+
+                names = ', '.join(column.split()[0] for column in TABLES[table])
+                with self.transaction():
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+                    cursor.execute(f"CREATE TABLE {table}_new ({table_definition(table)})")
+                    cursor.execute(f"INSERT INTO {table}_new (target, {names}) SELECT '', {names} FROM {table}")
+                    cursor.execute(f"DROP TABLE {table}")
+                    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+                self.logger.info(f"Column target added to table {table}")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error migrating table {table}: {str(e)}")
+
+    @DB_DURATION.time("insert_file_info")
+    def insert_file_info(self, filename, last_modified, last_checked, zone_id=None, digest=None):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("INSERT INTO file_info (target, filename, last_modified, last_checked, zone_id, digest) VALUES (?, ?, ?, ?, ?, ?)", (self.target, filename, last_modified, last_checked, zone_id, digest))
+                self.commit()
+                return True
         except sqlite3.Error as e:
             self.logger.error(f"Error inserting file info: {str(e)}")
             return False
 
+    @DB_DURATION.time("update_file_info")
     def update_file_info(self, filename, last_modified, last_checked):
         try:
-            conn = sqlite3.connect(self.db_filename)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE file_info SET last_modified = ?, last_checked = ? WHERE filename = ?", (last_modified, last_checked, filename))
-            conn.commit()
-            conn.close()
-            return True
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("UPDATE file_info SET last_modified = ?, last_checked = ? WHERE target = ? AND filename = ?", (last_modified, last_checked, self.target, filename))
+                self.commit()
+                return True
         except sqlite3.Error as e:
             self.logger.error(f"Error updating file info: {str(e)}")
             return False
 
+    @DB_DURATION.time("delete_file_info")
     def delete_file_info(self, filename):
         try:
-            conn = sqlite3.connect(self.db_filename)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM file_info WHERE filename = ?", [filename])
-            conn.commit()
-            conn.close()
-            return True
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("DELETE FROM file_info WHERE target = ? AND filename = ?", [self.target, filename])
+                cursor.execute("DELETE FROM zone_snapshot WHERE target = ? AND filename = ?", [self.target, filename])
+                self.commit()
+                return True
         except sqlite3.Error as e:
             self.logger.error(f"Error deleting file info: {str(e)}")
             return False
 
+    @DB_DURATION.time("get_file_info")
     def get_file_info(self, filename):
         try:
-            conn = sqlite3.connect(self.db_filename)
-            cursor = conn.cursor()
-            cursor.execute("SELECT last_modified, last_checked FROM file_info WHERE filename = ?", (filename,))
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                return result[0], result[1] 
-            else:
-                return None, None
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT last_modified, last_checked FROM file_info WHERE target = ? AND filename = ?", (self.target, filename))
+                result = cursor.fetchone()
+                if result:
+                    return result[0], result[1] 
+                else:
+                    return None, None
         except sqlite3.Error as e:
             self.logger.error(f"Error getting file info: {str(e)}")
             return None, None
 
-    def get_files_not_checked_since(self, since_datetime):
+    # All files of the table as dict filename => (last_modified, last_checked) with a single query
+    @DB_DURATION.time("get_all_file_info")
+    def get_all_file_info(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT filename, last_modified, last_checked FROM file_info WHERE target = ?", (self.target,))
+                return {filename: (last_modified, last_checked) for filename, last_modified, last_checked in cursor.fetchall()}
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting all file info: {str(e)}")
+            return {}
+
+    @DB_DURATION.time("get_zone_id")
+    def get_zone_id(self, filename):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT zone_id FROM file_info WHERE target = ? AND filename = ?", (self.target, filename))
+                result = cursor.fetchone()
+                if result:
+                    return result[0]
+                else:
+                    return None
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting zone id: {str(e)}")
+            return None
+
+    @DB_DURATION.time("set_zone_id")
+    def set_zone_id(self, filename, zone_id):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("UPDATE file_info SET zone_id = ? WHERE target = ? AND filename = ?", (zone_id, self.target, filename))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error setting zone id: {str(e)}")
+            return False
+
+    @DB_DURATION.time("get_digest")
+    def get_digest(self, filename):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT digest FROM file_info WHERE target = ? AND filename = ?", (self.target, filename))
+                result = cursor.fetchone()
+                if result:
+                    return result[0]
+                else:
+                    return None
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting digest: {str(e)}")
+            return None
+
+    @DB_DURATION.time("set_digest")
+    def set_digest(self, filename, digest):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("UPDATE file_info SET digest = ? WHERE target = ? AND filename = ?", (digest, self.target, filename))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error setting digest: {str(e)}")
+            return False
+
+    @DB_DURATION.time("get_snapshot")
+    def get_snapshot(self, filename):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT records FROM zone_snapshot WHERE target = ? AND filename = ?", (self.target, filename))
+                result = cursor.fetchone()
+                if result:
+                    return json.loads(result[0])
+                else:
+                    return None
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.error(f"Error getting snapshot: {str(e)}")
+            return None
+
+    # Save the records of a zone; without records the snapshot will be removed
+    @DB_DURATION.time("set_snapshot")
+    def set_snapshot(self, filename, records):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                if records is None:
+                    cursor.execute("DELETE FROM zone_snapshot WHERE target = ? AND filename = ?", (self.target, filename))
+                else:
+                    cursor.execute("INSERT OR REPLACE INTO zone_snapshot (target, filename, records) VALUES (?, ?, ?)", (self.target, filename, json.dumps(records)))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error setting snapshot: {str(e)}")
+            return False
+
+    # Update the check time of many unchanged files at once; rows are (filename, last_modified, last_checked)
+    @DB_DURATION.time("update_check_times")
+    def update_check_times(self, rows):
         try:
-            conn = sqlite3.connect(self.db_filename)
-            cursor = conn.cursor()
-            cursor.execute("SELECT filename, last_checked FROM file_info WHERE last_checked <= ?", (since_datetime,))
-            rows = cursor.fetchall()
-            conn.close()
-            return rows
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.executemany("UPDATE file_info SET last_modified = ?, last_checked = ? WHERE target = ? AND filename = ?",
+                                   [(last_modified, last_checked, self.target, filename) for filename, last_modified, last_checked in rows])
+                self.commit()
+                return True
         except sqlite3.Error as e:
-            self.logger.error(f"Error getting files not checked since: {str(e)}")
+            self.logger.error(f"Error updating check times: {str(e)}")
+            return False
+
+    # Add a job or count up the attempts of an existing job of the same file
+    @DB_DURATION.time("save_job")
+    def save_job(self, filename, operation, next_run, last_error=None):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT attempts FROM sync_jobs WHERE target = ? AND filename = ?", (self.target, filename))
+                result = cursor.fetchone()
+                if result:
+                    cursor.execute("UPDATE sync_jobs SET operation = ?, attempts = ?, next_run = ?, last_error = ? WHERE target = ? AND filename = ?",
+                                   (operation, result[0] + 1, next_run, last_error, self.target, filename))
+                    attempts = result[0] + 1
+                else:
+                    cursor.execute("INSERT INTO sync_jobs (target, filename, operation, attempts, next_run, last_error) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (self.target, filename, operation, 1, next_run, last_error))
+                    attempts = 1
+                self.commit()
+                return attempts
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving job: {str(e)}")
+            return None
+
+    @DB_DURATION.time("get_job_attempts")
+    def get_job_attempts(self, filename):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT attempts FROM sync_jobs WHERE target = ? AND filename = ?", (self.target, filename))
+                result = cursor.fetchone()
+                return result[0] if result else 0
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting job: {str(e)}")
+            return 0
+
+    # Jobs whose next run is due as list of (filename, operation, attempts)
+    @DB_DURATION.time("get_due_jobs")
+    def get_due_jobs(self, now):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT filename, operation, attempts FROM sync_jobs WHERE target = ? AND next_run <= ? ORDER BY next_run", (self.target, now))
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting due jobs: {str(e)}")
             return []
+
+    # Postpone a job without counting an attempt, e.g. while it is handed to a worker
+    @DB_DURATION.time("postpone_job")
+    def postpone_job(self, filename, next_run):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("UPDATE sync_jobs SET next_run = ? WHERE target = ? AND filename = ?", (next_run, self.target, filename))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error postponing job: {str(e)}")
+            return False
+
+    @DB_DURATION.time("delete_job")
+    def delete_job(self, filename):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("DELETE FROM sync_jobs WHERE target = ? AND filename = ?", (self.target, filename))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error deleting job: {str(e)}")
+            return False
+
+    @DB_DURATION.time("count_jobs")
+    def count_jobs(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM sync_jobs WHERE target = ?", (self.target,))
+                return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            self.logger.error(f"Error counting jobs: {str(e)}")
+            return 0
+
+    # Number of known zone files and of those with a zone at Hetzner as (files, zones)
+    @DB_DURATION.time("count_file_info")
+    def count_file_info(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT COUNT(*), COUNT(zone_id) FROM file_info WHERE target = ?", (self.target,))
+                return cursor.fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error counting file info: {str(e)}")
+            return (0, 0)
+
+    # The next file with a zone at Hetzner after the given file name in alphabetical order as
+    # (filename, zone_id, last_modified); starts from the beginning at the end. Used to walk round-robin through all zones.
+    @DB_DURATION.time("get_next_zone")
+    def get_next_zone(self, after_filename=None):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT filename, zone_id, last_modified FROM file_info WHERE target = ? AND zone_id IS NOT NULL AND filename > ? ORDER BY filename LIMIT 1",
+                               (self.target, after_filename or ""))
+                result = cursor.fetchone()
+                if result is None and after_filename:
+                    cursor.execute("SELECT filename, zone_id, last_modified FROM file_info WHERE target = ? AND zone_id IS NOT NULL ORDER BY filename LIMIT 1", (self.target,))
+                    result = cursor.fetchone()
+                return result
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting the next zone: {str(e)}")
+            return None
+
+    # Returns (generation, identity, last scan time) of a directory or (None, None, None)
+    @DB_DURATION.time("get_checkpoint")
+    def get_checkpoint(self, directory):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT generation, identity, last_scan FROM scan_checkpoint WHERE target = ? AND directory = ?", (self.target, directory))
+                result = cursor.fetchone()
+                return result if result else (None, None, None)
+        except sqlite3.Error as e:
+            self.logger.error(f"Error getting checkpoint: {str(e)}")
+            return (None, None, None)
+
+    @DB_DURATION.time("save_checkpoint")
+    def save_checkpoint(self, directory, generation, identity, last_scan):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("INSERT OR REPLACE INTO scan_checkpoint (target, directory, generation, identity, last_scan) VALUES (?, ?, ?, ?, ?)",
+                               (self.target, directory, generation, identity, last_scan))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving checkpoint: {str(e)}")
+            return False
+
+    # Forget the modification times of all files; the next scan compares the digests instead
+    @DB_DURATION.time("reset_modification_times")
+    def reset_modification_times(self):
+        try:
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute("UPDATE file_info SET last_modified = NULL WHERE target = ?", (self.target,))
+                self.commit()
+                return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error resetting the modification times: {str(e)}")
+            return False
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import logging
+import threading
+from modules.hetzner_dns import ZoneNotFoundError, ZONE_TTL
+from modules.metrics import DRIFT_CHECKS
+from modules.zone_file import parse_zone, zone_default_ttl, diff_records, ZoneParseError
+
+# Compare two record lists like the upload does, without the records managed by Hetzner. The
+# names are canonical and the TTLs effective values (see parse_zone), so both are compared exactly.
+def records_differ(local_records, remote_records):
+    return any(diff_records(local_records, remote_records))
+
+# Walks slowly and round-robin through all zones and compares the records at Hetzner with the
+# zone file; changes in the Hetzner console or a partly failed import are found this way.
+# Only one export request per zone; a whole cycle is spread over cycle_period seconds
+# and never more than max_requests per minute are sent. While the scheduler has work or the
+# API throttles, the verifier waits.
+class DriftVerifier:
+    def __init__(self, handler, cycle_period=86400, max_requests=10, logger=None):
+        # The handler knows the client, the database, the directory and the scheduler
+        self.handler = handler
+        self.cycle_period = cycle_period
+        self.max_requests = max_requests
+        self.logger = logger if logger else logging.getLogger("DriftVerifier")
+
+        # File name of the last verified zone
+        self.cursor = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="DriftVerifier", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+
+    # Seconds between two zones; the zone count may change while the daemon runs
+    def interval(self):
+        _, zones = self.handler.db_manager.count_file_info()
+        return max(self.cycle_period / max(1, zones), 60.0 / max(0.001, self.max_requests))
+
+    # Live updates come first
+    def is_busy(self):
+        rate_limiter = self.handler.hetzner_dns.rate_limiter
+        if rate_limiter is not None and rate_limiter.rate < rate_limiter.max_rate:
+            return True
+        return self.handler.scheduler.pending_count() > 0 or bool(self.handler.scheduler.in_flight)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval()):
+            if self.is_busy():
+                DRIFT_CHECKS.inc("skipped")
+                continue
+            try:
+                self.verify_next()
+            except Exception as e:
+                DRIFT_CHECKS.inc("error")
+                self.logger.error(f"Error verifying zone: {str(e)}")
+
+    # Verify the next zone; returns True if it drifted
+    def verify_next(self):
+        zone = self.handler.db_manager.get_next_zone(self.cursor)
+        if zone is None:
+            return False
+        file_name, zone_id, last_modified = zone
+        self.cursor = file_name
+
+        # A file which was changed after its last upload will be synchronized anyway
+        entry = self.handler.scanner.stat_zone(file_name)
+        if entry is None or entry.mtime_ns != last_modified:
+            DRIFT_CHECKS.inc("skipped")
+            return False
+
+        domain = self.handler.hetzner_dns.get_domain(file_name)
+        try:
+            export = self.handler.hetzner_dns.export_zone(zone_id)
+        except ZoneNotFoundError:
+            # The zone was deleted at Hetzner; the sync creates it again
+            export = ""
+        if export is None:
+            DRIFT_CHECKS.inc("error")
+            return False
+
+        # Records without a TTL of their own get the TTL of the zone at Hetzner, on both sides;
+        # so the effective TTLs are compared and not whether a file writes them out
+        zone_ttl = zone_default_ttl(export)
+        if zone_ttl is None:
+            zone_ttl = ZONE_TTL
+
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as file:
+                local_records = parse_zone(file, domain, zone_ttl)
+        except (OSError, UnicodeDecodeError, ZoneParseError) as e:
+            # Without parsed records there is nothing to compare
+            DRIFT_CHECKS.inc("skipped")
+            self.logger.debug(f"Could not parse {file_name}: {str(e)}")
+            return False
+
+        try:
+            remote_records = parse_zone(export, domain, zone_ttl)
+        except ZoneParseError as e:
+            DRIFT_CHECKS.inc("error")
+            self.logger.error(f"Could not parse the export of {domain}: {str(e)}")
+            return False
+
+        if not records_differ(local_records, remote_records):
+            DRIFT_CHECKS.inc("ok")
+            return False
+
+        DRIFT_CHECKS.inc("drift")
+        self.logger.warning(f"Zone {domain} differs from {file_name}, uploading it again")
+        self.handler.request_resync(file_name)
+        return True
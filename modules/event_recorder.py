@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import json
+import time
+import logging
+import threading
+
+# Writes every file system event which reaches the observer handler to a trace file, one
+# compact JSON array per line:
+#   [time, event_type, is_directory, src_path]             e.g. [1697104800.123456, "modified", 0, "/var/named/a.db"]
+#   [time, event_type, is_directory, src_path, dest_path]  for moved events
+# The event types are the ones of watchdog; the inotify backend writes "in_close_write",
+# "in_moved_to", "in_moved_from" and "in_delete". tools/replay_events.py replays the file.
+class EventRecorder:
+    def __init__(self, trace_path="", logger=None):
+        # Without a path the recorder does nothing
+        self.trace_path = trace_path
+        self.logger = logger if logger else logging.getLogger("EventRecorder")
+        # The watchers of all targets write to the same file
+        self.lock = threading.Lock()
+        self.trace_file = None
+
+        if self.trace_path:
+            try:
+                self.trace_file = open(self.trace_path, 'a')
+            except OSError as e:
+                self.logger.error(f"Error opening the event trace {self.trace_path}: {str(e)}")
+
+    def enabled(self):
+        return self.trace_file is not None
+
+    def close(self):
+        with self.lock:
+            if self.trace_file:
+                self.trace_file.close()
+                self.trace_file = None
+
+    def record(self, event_type, src_path, dest_path=None, is_directory=False):
+        if self.trace_file is None:
+            return
+
+        event = [round(time.time(), 6), event_type, 1 if is_directory else 0, src_path]
+        if dest_path:
+            event.append(dest_path)
+        line = json.dumps(event, separators=(",", ":"))
+
+        with self.lock:
+            if self.trace_file is None:
+                return
+            try:
+                # Flushed by line, so an event storm can still be read while the daemon runs
+                self.trace_file.write(line + "\n")
+                self.trace_file.flush()
+            except OSError as e:
+                self.logger.error(f"Error writing the event trace: {str(e)}")
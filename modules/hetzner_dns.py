@@ -8,15 +8,179 @@ __email__      = "github@maker-hub.de"
 __status__     = "Development"
 __date__       = "12.10.2023"
 
+import os
+import gzip
+import random
+import shutil
+import tempfile
 import requests
 import json
 import logging
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from modules.metrics import API_REQUEST_DURATION, API_RESPONSES, API_RETRIES
+
+API_URL = "https://dns.hetzner.com/api/v1"
+# TTL of the zones we create; records without a TTL of their own get it
+ZONE_TTL = 11400
+
+# Exponential backoff with jitter, so parallel requests don't retry all at the same time.
+# The responses which are retried (e.g. 429) are shown to the rate limiter as well.
+class JitterRetry(Retry):
+    rate_limiter = None
+    target = ""
+
+    def new(self, **kwargs):
+        retry = super(JitterRetry, self).new(**kwargs)
+        retry.rate_limiter = self.rate_limiter
+        retry.target = self.target
+        return retry
+
+    def get_backoff_time(self):
+        backoff_time = super(JitterRetry, self).get_backoff_time()
+        return random.uniform(0, backoff_time)
+
+    def increment(self, method=None, url=None, response=None, *args, **kwargs):
+        API_RETRIES.inc(self.target)
+        if response is not None and self.rate_limiter:
+            self.rate_limiter.update_from_headers(response.headers, response.status)
+        return super(JitterRetry, self).increment(method, url, response, *args, **kwargs)
+
+# Path of a request with the ids replaced, e.g. /zones/{id}/import; used as label of the metrics
+def endpoint_name(path):
+    parts = path.strip('/').split('/')
+    return '/' + '/'.join('{id}' if index == 1 and part != 'bulk' else part for index, part in enumerate(parts))
+
+# Block size for reading zone files while uploading
+CHUNK_SIZE = 64 * 1024
+# Compressed uploads are kept in memory up to this size, bigger ones in a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+# Request body which is read in blocks from a file, optionally after a prefix (e.g. the
+# $ORIGIN line). requests sends it with a Content-Length header; seek/tell let urllib3
+# rewind it for a retry. Only one block is in memory at a time.
+class StreamBody:
+    def __init__(self, file, length, prefix=b""):
+        self.file = file
+        self.prefix = prefix
+        self.length = len(prefix) + length
+        self.position = 0
+        self.file_start = file.tell()
+
+    def __len__(self):
+        return self.length
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.length
+        self.position = max(0, min(offset, self.length))
+        self.file.seek(self.file_start + max(0, self.position - len(self.prefix)))
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+
+        data = b""
+        if self.position < len(self.prefix):
+            data = self.prefix[self.position:self.position + size]
+            self.position += len(data)
+            size -= len(data)
+
+        if size > 0 and self.position < self.length:
+            block = self.file.read(min(size, self.length - self.position))
+            self.position += len(block)
+            data += block
+
+        return data
+
+# Compress a body into a spooled temporary file; returns the file and its length
+def gzip_body(body):
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with gzip.GzipFile(fileobj=spool, mode='wb') as compressed:
+        shutil.copyfileobj(body, compressed, CHUNK_SIZE)
+    length = spool.tell()
+    spool.seek(0)
+    return spool, length
+
+# Raised if the API doesn't know the zone id (anymore), e.g. the zone was deleted in the Hetzner console
+class ZoneNotFoundError(Exception):
+    pass
 
 class HetznerDNS:
-    def __init__(self, auth_api_token, logger=None):
+    def __init__(self, auth_api_token, pool_size=10, connect_timeout=5, read_timeout=30,
+                 max_retries=3, backoff_factor=0.5, rate_limiter=None, api_url=API_URL,
+                 compress_uploads=False, target="", logger=None):
         self.auth_api_token = auth_api_token
+        # Name of the watch target; the label of the API metrics
+        self.target = target
+        # Send the zone imports gzip compressed; switched off by itself if the API refuses it
+        self.compress_uploads = compress_uploads
+        # Set by the first compressed import which succeeded; from then on an error is one of the zone
+        self.compression_accepted = False
+        # Shared by all workers to stay below the request limit of the API
+        self.rate_limiter = rate_limiter
+        # Base URL of the API; can point to a local test server
+        self.api_url = api_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
         self.logger = logger if logger else logging.getLogger("HeznerDNS")
 
+        # Retry on rate limiting and server errors; the import is idempotent and a
+        # repeated create of a zone is answered with 422, so these methods can be retried.
+        # The bulk create of records is not: see below.
+        self.max_retries = max_retries
+        retries = JitterRetry(total=max_retries,
+                              backoff_factor=backoff_factor,
+                              status_forcelist=[429, 500, 502, 503, 504],
+                              allowed_methods=None,
+                              respect_retry_after_header=True,
+                              raise_on_status=False)
+        retries.rate_limiter = rate_limiter
+        retries.target = target
+
+        # One long-lived session keeps the connections (and TLS handshakes) alive between the requests
+        self.session = requests.Session()
+        self.session.headers.update({"Auth-API-Token": self.auth_api_token})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # A POST to /records/bulk which failed with a 5xx or a read timeout may have been applied
+        # already; sent again it would create the records twice. Only connection errors (the
+        # request never reached the API) are retried for it, a 429 is retried by send_bulk_records.
+        bulk_retries = retries.new(allowed_methods=Retry.DEFAULT_ALLOWED_METHODS)
+        self.session.mount(f"{self.api_url}/records/bulk", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=bulk_retries))
+
+    def close(self):
+        self.session.close()
+
+    # Send a request to the API through the pooled session
+    def request(self, method, path, **kwargs):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        endpoint = endpoint_name(path)
+        start_time = time.perf_counter()
+        try:
+            response = self.session.request(method, url=f"{self.api_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            API_RESPONSES.inc(self.target, method, endpoint, "error")
+            raise
+        finally:
+            API_REQUEST_DURATION.observe(time.perf_counter() - start_time, self.target, method, endpoint)
+
+        API_RESPONSES.inc(self.target, method, endpoint, str(response.status_code))
+        if self.rate_limiter:
+            # Slow down before the quota of the API is used up
+            self.rate_limiter.update_from_headers(response.headers, response.status_code)
+        return response
+
     def get_domain(self, file_name):
         # Extract the domain name from the file name by removing the '.db' extension
         domain, _ = os.path.splitext(file_name)
@@ -30,11 +194,8 @@ class HetznerDNS:
 
     def get_zone_id(self, domain):
         try:
-            response = requests.get(
-                url="https://dns.hetzner.com/api/v1/zones",
-                headers={
-                    "Auth-API-Token": self.auth_api_token,
-                },
+            response = self.request(
+                "GET", "/zones",
                 params={
                     "search_name": domain
                 }
@@ -49,25 +210,66 @@ class HetznerDNS:
                     self.logger.error(f"Error decoding JSON: {str(e)}")
                     return None
 
-                # Retrieve the zone ID
-                zone_id = json_object["zones"][0]["id"]
-                return zone_id
+                # Retrieve the zone ID; the search also finds similar names
+                for zone in json_object.get("zones") or []:
+                    if zone["name"] == domain:
+                        return zone["id"]
+                return None
             else:
                 return None
         except requests.exceptions.RequestException:
             return None
 
+    # Walk through all pages of the zone list and return an index domain => zone id.
+    # One request per page instead of one search per zone file.
+    def get_all_zones(self, per_page=100):
+        zone_index = {}
+        page = 1
+        last_page = 1
+
+        try:
+            while page <= last_page:
+                response = self.request(
+                    "GET", "/zones",
+                    params={
+                        "page": page,
+                        "per_page": per_page
+                    }
+                )
+
+                if response.status_code != 200:
+                    self.logger.error(f"Couldn't get the zone list, status code {response.status_code}")
+                    return None
+
+                # Parse JSON data
+                try:
+                    json_object = json.loads(response.content)
+                except json.JSONDecodeError as e:
+                    self.logger.error(f"Couldn't get the zone list")
+                    self.logger.error(f"Error decoding JSON: {str(e)}")
+                    return None
+
+                for zone in json_object.get("zones") or []:
+                    zone_index[zone["name"]] = zone["id"]
+
+                pagination = json_object.get("meta", {}).get("pagination", {})
+                last_page = pagination.get("last_page", page)
+                page += 1
+
+            return zone_index
+        except requests.exceptions.RequestException:
+            return None
+
     def create_zone(self, domain):
         try:
-            response = requests.post(
-                url="https://dns.hetzner.com/api/v1/zones",
+            response = self.request(
+                "POST", "/zones",
                 headers={
                     "Content-Type": "application/json",
-                    "Auth-API-Token": self.auth_api_token,
                 },
                 data=json.dumps({
                     "name": domain,
-                    "ttl": 11400
+                    "ttl": ZONE_TTL
                 })
             )
 
@@ -82,6 +284,7 @@ class HetznerDNS:
 
                 # Retrieve the zone ID
                 zone_id = json_object["zone"]["id"]
+                return zone_id
 
             elif response.status_code in [401, 404, 406]:  # Unauthorized, not found, Not acceptable
                 return None
@@ -96,15 +299,12 @@ class HetznerDNS:
 
     def delete_zone(self, zone_id):
         try:
-            response = requests.post(
-                url=f"https://dns.hetzner.com/api/v1/zones/{zone_id}",
-                headers={
-                    "Auth-API-Token": self.auth_api_token,
-                },
-            )
+            response = self.request("DELETE", f"/zones/{zone_id}")
 
             if response.status_code == 200: # Successful response
-                print(response.content)
+                self.logger.info(f"Zone {zone_id} deleted")
+                return True
+            elif response.status_code == 404: # The zone is already gone
                 return True
             else:
                 return False
@@ -120,28 +320,209 @@ class HetznerDNS:
             return False
                 
         # Send an HTTP request to transmit the modified file
-        print(f"Open file {file_path} for read")
-        with open(file_path, 'rb') as file:
-
-            # Read bytes from the file and convert it to a string
-            file_content = file.read().decode('utf-8')
-
-            # Create request data
-            request_data = f"$ORIGIN {domain}.\n{file_content}"
-            try:
-                response = requests.post(
-                    url=f"https://dns.hetzner.com/api/v1/zones/{zone_id}/import",
-                    headers={
-                        "Content-Type": "text/plain",
-                        "Auth-API-Token": self.auth_api_token,
-                    },
-                    data=request_data
-                )
+        self.logger.debug(f"Open file {file_path} for read")
+        try:
+            with open(file_path, 'rb') as file:
+                # The file is streamed behind the $ORIGIN line; it is never read as a whole
+                body = StreamBody(file, os.fstat(file.fileno()).st_size, f"$ORIGIN {domain}.\n".encode('utf-8'))
 
-                if response.status_code in [200, 201]:  # Successful response, Create
-                    print(response.content)
-                    return True
+                if self.compress_uploads:
+                    response = self.send_compressed_import(zone_id, body)
+                    if response is None:
+                        body.seek(0)
+                        response = self.send_import(zone_id, body)
+                        if response.status_code in [200, 201]:
+                            self.logger.info("The API doesn't accept compressed imports, sending them uncompressed")
+                            self.compress_uploads = False
                 else:
+                    response = self.send_import(zone_id, body)
+        except OSError as e:
+            self.logger.error(f"Error reading {file_path}: {str(e)}")
+            return False
+        except requests.exceptions.RequestException:
+            return False
+
+        if response.status_code in [200, 201]:  # Successful response, Create
+            self.logger.info(f"Zone {domain} imported from {file_path}")
+            return True
+        elif response.status_code == 404: # The zone id is unknown
+            raise ZoneNotFoundError(zone_id)
+        else:
+            self.logger.error(f"Import of zone {domain} failed, status code {response.status_code}")
+            return False
+
+    def send_import(self, zone_id, body, headers=None):
+        return self.request(
+            "POST", f"/zones/{zone_id}/import",
+            headers=dict({
+                "Content-Type": "text/plain",
+            }, **(headers or {})),
+            data=body
+        )
+
+    # Send the import gzip compressed; None if it should be sent again uncompressed
+    def send_compressed_import(self, zone_id, body):
+        spool, length = gzip_body(body)
+        with spool:
+            response = self.send_import(zone_id, StreamBody(spool, length), {"Content-Encoding": "gzip"})
+
+        if response.status_code in [200, 201]:
+            self.compression_accepted = True
+        elif (not self.compression_accepted and 400 <= response.status_code < 500
+              and response.status_code not in [401, 403, 404, 429]):
+            # An API which ignores the Content-Encoding reads the compressed bytes as zone file and
+            # answers 400, 415, 422 or the like. Until a compressed import worked, every such error
+            # is tried once more uncompressed; the caller switches compression off if that works.
+            # Authorization, unknown zone and rate limit are the same for both.
+            self.logger.debug(f"Compressed import failed with status code {response.status_code}, sending it uncompressed")
+            return None
+        return response
+
+    # Export of a zone in the BIND format; one request for all records
+    def export_zone(self, zone_id):
+        try:
+            response = self.request("GET", f"/zones/{zone_id}/export")
+
+            if response.status_code == 200:
+                return response.content.decode('utf-8', errors='replace')
+            elif response.status_code == 404: # The zone id is unknown
+                raise ZoneNotFoundError(zone_id)
+            else:
+                self.logger.error(f"Export of zone {zone_id} failed, status code {response.status_code}")
+                return None
+        except requests.exceptions.RequestException:
+            return None
+
+    # Get all records of a zone
+    def get_records(self, zone_id, per_page=100):
+        records = []
+        page = 1
+        last_page = 1
+
+        try:
+            while page <= last_page:
+                response = self.request(
+                    "GET", "/records",
+                    params={
+                        "zone_id": zone_id,
+                        "page": page,
+                        "per_page": per_page
+                    }
+                )
+
+                if response.status_code == 404: # The zone id is unknown
+                    raise ZoneNotFoundError(zone_id)
+                if response.status_code != 200:
+                    self.logger.error(f"Couldn't get the records of zone {zone_id}, status code {response.status_code}")
+                    return None
+
+                # Parse JSON data
+                try:
+                    json_object = json.loads(response.content)
+                except json.JSONDecodeError as e:
+                    self.logger.error(f"Couldn't get the records of zone {zone_id}")
+                    self.logger.error(f"Error decoding JSON: {str(e)}")
+                    return None
+
+                records.extend(json_object.get("records") or [])
+
+                pagination = json_object.get("meta", {}).get("pagination", {})
+                last_page = pagination.get("last_page", page)
+                page += 1
+
+            return records
+        except requests.exceptions.RequestException:
+            return None
+
+    # Record of the API from a parsed record [name, type, value, ttl]
+    def record_data(self, zone_id, record, record_id=None):
+        name, record_type, value, ttl = record
+        data = {
+            "zone_id": zone_id,
+            "type": record_type,
+            "name": name,
+            "value": value
+        }
+        if ttl is not None:
+            data["ttl"] = ttl
+        if record_id is not None:
+            data["id"] = record_id
+        return data
+
+    # Send a bulk request and check that every record was accepted
+    def send_bulk_records(self, method, records):
+        for attempt in range(self.max_retries + 1):
+            response = self.request(
+                method, "/records/bulk",
+                headers={
+                    "Content-Type": "application/json",
+                },
+                data=json.dumps({"records": records})
+            )
+            # A request refused by the rate limit didn't change anything; the rate limiter
+            # waits for the reset before the next try
+            if response.status_code != 429:
+                break
+
+        if response.status_code not in [200, 201]:
+            self.logger.error(f"Bulk {method} of records failed, status code {response.status_code}")
+            return False
+
+        try:
+            json_object = json.loads(response.content)
+        except json.JSONDecodeError:
+            # No details, but the status code says it worked
+            return True
+
+        if json_object.get("invalid_records"):
+            self.logger.error(f"Bulk {method} of records contains invalid records: {json_object['invalid_records']}")
+            return False
+
+        return True
+
+    # Send only the changed records of a zone instead of the whole zone file.
+    # Returns False if the changes couldn't be applied; then the full import should be used.
+    def update_zone_records(self, zone_id, additions, updates, deletions):
+        try:
+            record_ids = {}
+            if updates or deletions:
+                # We need the ids of the records which will be changed or deleted
+                remote_records = self.get_records(zone_id)
+                if remote_records is None:
                     return False
-            except requests.exceptions.RequestException:
-                return False
+                for remote_record in remote_records:
+                    key = (remote_record.get("name"), remote_record.get("type"), remote_record.get("value"))
+                    record_ids[key] = remote_record.get("id")
+
+            # Delete first; a new CNAME may replace old records with the same name
+            for record in deletions:
+                record_id = record_ids.get(tuple(record[:3]))
+                if record_id is None:
+                    self.logger.info(f"Record {record[:3]} not found in zone {zone_id}")
+                    return False
+
+                response = self.request("DELETE", f"/records/{record_id}")
+                if response.status_code not in [200, 404]: # 404: the record is already gone
+                    self.logger.error(f"Couldn't delete record {record_id}, status code {response.status_code}")
+                    return False
+
+            if updates:
+                records = []
+                for record in updates:
+                    record_id = record_ids.get(tuple(record[:3]))
+                    if record_id is None:
+                        self.logger.info(f"Record {record[:3]} not found in zone {zone_id}")
+                        return False
+                    records.append(self.record_data(zone_id, record, record_id))
+
+                if not self.send_bulk_records("PUT", records):
+                    return False
+
+            if additions:
+                records = [self.record_data(zone_id, record) for record in additions]
+                if not self.send_bulk_records("POST", records):
+                    return False
+
+            return True
+        except requests.exceptions.RequestException:
+            return False
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+# Flags and events from <sys/inotify.h>
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+
+# Only finished writes, files moved in or out and deleted files; the many modify events
+# of a file which is still written never reach us
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event: int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[len]
+EVENT_HEADER = struct.Struct("iIII")
+
+def load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+# Watches the zone directory with the inotify API of Linux directly; a replacement for the
+# watchdog observer with the same start/stop/join methods. It hands the zone files to
+# handler.schedule_file like the observer does. If events were lost the reconcile function
+# is called, which compares the whole directory with the database.
+class InotifyWatcher:
+    def __init__(self, handler, directory, reconcile=None, logger=None):
+        self.handler = handler
+        self.directory = os.path.abspath(directory)
+        self.reconcile = reconcile
+        self.logger = logger if logger else logging.getLogger("InotifyWatcher")
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.fd = None
+        # Set if the watched directory was removed or moved; it is watched again once it is back
+        self.watch_lost = False
+
+    # Only on Linux with a libc which knows inotify
+    @staticmethod
+    def available():
+        return load_libc() is not None
+
+    # A new inotify instance watching the directory; raises OSError
+    def open_watch(self):
+        libc = load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, f"{os.strerror(error)}: {self.directory}")
+
+        return fd
+
+    def start(self):
+        self.fd = self.open_watch()
+        self.watch_lost = False
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="InotifyWatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.fd is None and not self.rewatch():
+                self.stop_event.wait(1)
+                continue
+
+            try:
+                # Wake up every second to notice the stop
+                readable, _, _ = select.select([self.fd], [], [], 1.0)
+                if not readable:
+                    continue
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                # Events may be lost; the watch is created again by rewatch, which reconciles the directory
+                self.logger.error(f"Error reading inotify events, watching {self.directory} again: {str(e)}")
+                os.close(self.fd)
+                self.fd = None
+                self.stop_event.wait(1)
+                continue
+
+            for mask, name in self.parse_events(buffer):
+                self.handle_event(mask, name)
+
+            if self.watch_lost and self.fd is not None:
+                # The watch follows the old directory; the path is watched again in rewatch
+                os.close(self.fd)
+                self.fd = None
+
+    # Watch the directory again after it was removed or moved, e.g. once a backup was restored.
+    # The changes in between are found by a reconciliation. Returns True if it is watched again.
+    def rewatch(self):
+        if not os.path.isdir(self.directory):
+            return False
+        try:
+            self.fd = self.open_watch()
+        except OSError as e:
+            self.logger.debug(f"Could not watch {self.directory} again: {str(e)}")
+            return False
+
+        self.watch_lost = False
+        self.logger.info(f"Watching {self.directory} again")
+        self.request_reconcile()
+        return True
+
+    # Compare the whole directory with the database; also finds the deletions of lost events
+    def request_reconcile(self):
+        if self.reconcile:
+            self.reconcile()
+        else:
+            threading.Thread(target=self.handler.check_4_changes, name="InotifyReconcile", daemon=True).start()
+
+    @staticmethod
+    def parse_events(buffer):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            _, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            # The name is padded with null bytes
+            name = buffer[offset:offset + length].split(b"\0", 1)[0]
+            offset += length
+            yield mask, os.fsdecode(name)
+
+    def handle_event(self, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # The kernel dropped events; the reconciliation finds the changed and the deleted zones
+            self.logger.warning("inotify queue overflow, reconciling the directory")
+            self.request_reconcile()
+            return
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            if not self.watch_lost:
+                self.logger.error(f"Watched directory {self.directory} was removed or moved, watching it again once it exists")
+            self.watch_lost = True
+            return
+
+        if name and self.handler.recorder.enabled():
+            self.record_event(mask, name)
+
+        # Filter here, so other files like the journals of named never reach the handler
+        if not name or not self.handler.is_relevant_file(name):
+            return
+
+        self.handler.schedule_file(os.path.join(self.directory, name))
+
+    # Write the event to the event trace of the handler before the filter, like the observer does
+    def record_event(self, mask, name):
+        file_path = os.path.join(self.directory, name)
+        for flag, event_type in [(IN_CLOSE_WRITE, "in_close_write"), (IN_MOVED_TO, "in_moved_to"),
+                                 (IN_MOVED_FROM, "in_moved_from"), (IN_DELETE, "in_delete")]:
+            if mask & flag:
+                self.handler.recorder.record(event_type, file_path)
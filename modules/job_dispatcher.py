@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import logging
+import threading
+import time
+from modules.sync_scheduler import PRIORITY_BULK
+
+# Hands the failed jobs of the database back to the scheduler once their retry is due.
+# The jobs are stored in the database, so they are retried after a restart as well.
+class JobDispatcher:
+    def __init__(self, db_manager, scheduler, poll_interval=10, lease_time=300, logger=None):
+        self.db_manager = db_manager
+        self.scheduler = scheduler
+        # Seconds between two looks into the job table
+        self.poll_interval = poll_interval
+        # Seconds a dispatched job is hidden; if the worker never reports back it will be dispatched again
+        self.lease_time = lease_time
+        self.logger = logger if logger else logging.getLogger("JobDispatcher")
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="JobDispatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+
+    def dispatch_due_jobs(self):
+        now = time.time()
+        for file_name, operation, attempts in self.db_manager.get_due_jobs(now):
+            self.logger.info(f"Retrying {operation} of {file_name} (attempt {attempts + 1})")
+            self.db_manager.postpone_job(file_name, now + self.lease_time)
+            # Retries wait behind the live changes
+            self.scheduler.schedule(file_name, immediate=True, priority=PRIORITY_BULK)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.dispatch_due_jobs()
+            except Exception as e:
+                self.logger.error(f"Error dispatching jobs: {str(e)}")
+            self.stop_event.wait(self.poll_interval)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import os
+import time
+import logging
+import threading
+import socketserver
+from contextlib import ContextDecorator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Simple counters, gauges and histograms in the Prometheus text format; no extra package needed
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def label_text(self, label_values, extra=None):
+        pairs = list(zip(self.labels, label_values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs]
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super(Counter, self).__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [f"{self.name}{self.label_text(key)} {value}" for key, value in sorted(self.values.items())]
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self.values = {}
+        self.functions = {}
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    # The value is read when the metrics are requested, e.g. the length of a queue
+    def set_function(self, function, *label_values):
+        with self.lock:
+            self.functions[label_values] = function
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{self.label_text(key)} {value}" for key, value in sorted(values.items())]
+
+# Measures the time of a block or a function:
+#   with histogram.time("label"):   or   @histogram.time("label")
+class Timer(ContextDecorator):
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    # Used as decorator every call needs its own timer; the threads would share the start time otherwise
+    def _recreate_cm(self):
+        return Timer(self.histogram, self.label_values)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values => [bucket counts, sum, count]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            entry = self.values.setdefault(label_values, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, *label_values):
+        return Timer(self, label_values)
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, (bucket_counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{self.name}_bucket{self.label_text(key, ('le', bound))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{self.label_text(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+                lines.append(f"{self.name}_count{self.label_text(key)} {count}")
+        return lines
+
+REGISTRY = []
+
+def render_metrics():
+    lines = []
+    for metric in list(REGISTRY):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# The metrics of the daemon
+SCAN_DURATION = Histogram("hetznerdns_scan_duration_seconds", "Duration of a full reconciliation (check_4_changes)")
+FILES_SCANNED = Counter("hetznerdns_files_scanned_total", "Zone files looked at by the reconciliation")
+FILES_SKIPPED = Counter("hetznerdns_files_skipped_total", "Zone files which didn't need an upload", ["reason"])
+SYNCS = Counter("hetznerdns_syncs_total", "Synchronized zones", ["operation", "result"])
+DRIFT_CHECKS = Counter("hetznerdns_drift_checks_total", "Zones compared with their records at Hetzner by the verifier", ["result"])
+# The API metrics are kept per watch target, i.e. per Hetzner account and its request limit
+API_REQUEST_DURATION = Histogram("hetznerdns_api_request_duration_seconds", "Duration of the requests to the Hetzner API", ["target", "method", "endpoint"])
+API_RESPONSES = Counter("hetznerdns_api_responses_total", "Responses of the Hetzner API", ["target", "method", "endpoint", "status"])
+API_RETRIES = Counter("hetznerdns_api_retries_total", "Retries of requests to the Hetzner API", ["target"])
+PENDING_EVENTS = Gauge("hetznerdns_pending_events", "Zones waiting in the scheduler")
+API_RATE = Gauge("hetznerdns_api_rate", "Requests per second allowed by the adaptive rate limiter", ["target"])
+QUEUED_JOBS = Gauge("hetznerdns_queued_jobs", "Failed syncs waiting for their retry")
+DB_DURATION = Histogram("hetznerdns_db_duration_seconds", "Duration of the SQLite operations", ["operation"])
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        data = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # BaseHTTPRequestHandler expects a (host, port) tuple
+    def get_request(self):
+        request, _ = super(UnixHTTPServer, self).get_request()
+        return request, ("local", 0)
+
+# Serves the metrics on a local port and/or a unix socket
+class MetricsServer:
+    def __init__(self, port=0, socket_path="", logger=None):
+        self.port = port
+        self.socket_path = socket_path
+        self.logger = logger if logger else logging.getLogger("MetricsServer")
+        self.servers = []
+
+    def start(self):
+        try:
+            if self.port:
+                # Only reachable from the server itself
+                self.servers.append(ThreadingHTTPServer(("127.0.0.1", self.port), MetricsRequestHandler))
+            if self.socket_path:
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+                self.servers.append(UnixHTTPServer(self.socket_path, MetricsRequestHandler))
+        except OSError as e:
+            self.logger.error(f"Error starting the metrics server: {str(e)}")
+
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import sys
+import math
+import time
+import logging
+from datetime import datetime
+from modules.zone_file import zone_digest
+
+# Zones listed per request of the zone list
+ZONES_PER_PAGE = 100
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m {seconds % 60:02d}s"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+# One-shot synchronization of a whole directory, e.g. for the onboarding of a server with
+# thousands of zones. It uses the scan and the workers of the observer handler; every zone is
+# saved in file_info right after its upload, so an interrupted run continues with the zones
+# which aren't synchronized yet. The plan shows what a run would do without changing anything.
+class Migration:
+    def __init__(self, handler, output=None, logger=None):
+        # The handler knows the client, the database, the directory and the scheduler
+        self.handler = handler
+        self.output = output if output else sys.stdout
+        self.logger = logger if logger else logging.getLogger("Migration")
+
+    def write(self, text):
+        self.output.write(text + "\n")
+        self.output.flush()
+
+    # Compare the directory with the database and the zones at Hetzner; only reads
+    def plan(self):
+        plan = self.handler.plan_changes(datetime.now().timestamp())
+
+        # The zones which already exist at Hetzner only get the import
+        zone_index = self.handler.hetzner_dns.get_all_zones() if plan.new else {}
+
+        # CWP and named often rewrite a file without changing it; those aren't uploaded
+        rewritten = []
+        for file_name in plan.modified:
+            entry = self.handler.scanner.stat_zone(file_name)
+            digest = self.handler.db_manager.get_digest(file_name)
+            if entry is not None and digest is not None and zone_digest(entry.path) == digest:
+                rewritten.append(file_name)
+
+        return plan, zone_index, rewritten
+
+    def print_plan(self, list_files=False):
+        plan, zone_index, rewritten = self.plan()
+        get_domain = self.handler.hetzner_dns.get_domain
+
+        if zone_index is None:
+            existing = []
+            self.write("  Could not get the zone list from Hetzner; the new zones are counted as to create")
+        else:
+            existing = [file_name for file_name in plan.new if get_domain(file_name) in zone_index]
+        created = len(plan.new) - len(existing)
+
+        self.write(f"  {len(plan.new)} new zone files: {created} zones to create, {len(existing)} already at Hetzner")
+        self.write(f"  {len(plan.modified)} modified zone files: {len(plan.modified) - len(rewritten)} with new content, {len(rewritten)} only rewritten")
+        self.write(f"  {len(plan.deleted)} deleted zone files")
+        self.write(f"  {len(plan.unchanged)} unchanged zone files")
+        if plan.filtered:
+            self.write(f"  {len(plan.filtered)} zone files left out by the filters; their zones stay at Hetzner")
+
+        # Create and import per new zone, one import per change, one delete per deleted zone and the pages of the zone list
+        requests = 2 * created + len(existing) + len(plan.modified) - len(rewritten) + len(plan.deleted)
+        if len(plan.new) > 1 and zone_index is not None:
+            requests += max(1, math.ceil(len(zone_index) / ZONES_PER_PAGE))
+        rate_limiter = self.handler.hetzner_dns.rate_limiter
+        if rate_limiter is not None and rate_limiter.max_rate > 0:
+            self.write(f"  About {requests} API requests, at least {format_duration(requests / rate_limiter.max_rate)} with {rate_limiter.max_rate:g} requests per second")
+        else:
+            self.write(f"  About {requests} API requests")
+
+        if list_files:
+            existing = set(existing)
+            rewritten = set(rewritten)
+            for file_name in sorted(plan.new):
+                self.write(f"    import  {file_name}" if file_name in existing else f"    create  {file_name}")
+            for file_name in sorted(plan.modified):
+                self.write(f"    check   {file_name}" if file_name in rewritten else f"    update  {file_name}")
+            for file_name in sorted(plan.deleted):
+                self.write(f"    delete  {file_name}")
+
+        return plan
+
+    # Synchronize all new, modified and deleted zone files with the workers of the scheduler,
+    # which must be started. Prints the progress every progress_interval seconds.
+    # Returns True if all zones were synchronized; an interruption is raised after the workers stopped.
+    def run(self, progress_interval=5):
+        scheduler = self.handler.scheduler
+
+        self.handler.load_checkpoint()
+        plan = self.handler.plan_changes(datetime.now().timestamp())
+        if plan.unchanged:
+            self.write(f"  {len(plan.unchanged)} zone files are already synchronized")
+
+        changed_files = self.handler.start_changes(plan)
+        total = len(changed_files)
+        self.write(f"  {total} zone files to synchronize ({len(plan.new)} new, {len(plan.modified)} modified, {len(plan.deleted)} deleted)")
+
+        start_time = time.monotonic()
+        try:
+            waiting = total
+            while waiting:
+                waiting = scheduler.wait_for(changed_files, progress_interval)
+                if not scheduler.running:
+                    break
+
+                done = total - waiting
+                elapsed = time.monotonic() - start_time
+                if done and waiting:
+                    eta = format_duration(elapsed / done * waiting)
+                else:
+                    eta = "-"
+                self.write(f"  {done}/{total} ({done * 100 // max(1, total)}%) in {format_duration(elapsed)}, "
+                           f"{done / elapsed if elapsed else 0.0:.1f} zones/s, ETA {eta}")
+        except KeyboardInterrupt:
+            # The syncs in flight are finished and saved; the next run continues with the rest
+            self.write("  Interrupted, waiting for the uploads in flight")
+            scheduler.stop()
+            scheduler.join()
+            self.write("  Run the command again to continue with the zones which aren't synchronized yet")
+            raise
+
+        self.handler.finish_scan()
+
+        # A failed sync is saved as retry job; the daemon or the next run takes it up again
+        failed = [file_name for file_name in changed_files if self.handler.db_manager.get_job_attempts(file_name) > 0]
+        elapsed = time.monotonic() - start_time
+        self.write(f"  {total - len(failed)} of {total} zone files synchronized in {format_duration(elapsed)}")
+        for file_name in sorted(failed):
+            self.write(f"    failed  {file_name}")
+        if failed:
+            self.write(f"  {len(failed)} zone files failed; see the log and run the command again")
+        return not failed
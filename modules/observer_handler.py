@@ -10,167 +10,480 @@ __date__       = "12.10.2023"
 
 import logging
 import os
+import time
+import threading
+from collections import namedtuple
 from datetime import datetime
-from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from modules.hetzner_dns import HetznerDNS
+from modules.hetzner_dns import ZoneNotFoundError
+from modules.sync_scheduler import SyncScheduler, PRIORITY_URGENT, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from modules.metrics import SCAN_DURATION, FILES_SCANNED, FILES_SKIPPED, SYNCS
+from modules.event_recorder import EventRecorder
+from modules.tracing import Tracer
+from modules.zone_file import zone_digest, parse_zone, diff_records, ZoneParseError
+from modules.zone_scanner import ZoneScanner
+
+# Result of the comparison of the directory with the database: the new, modified and deleted zone
+# files, the unchanged ones as (file name, modification time, check time) and the ones which are
+# left out by the filters now
+ScanPlan = namedtuple("ScanPlan", ["new", "modified", "deleted", "unchanged", "filtered"])
 
 class ObserverHandler(FileSystemEventHandler):
-    def __init__(self, db_manager, auth_api_token, directory, observer, logger=None):
+    def __init__(self, db_manager, hetzner_dns, directory, debounce_seconds=2, max_delay=30, workers=4,
+                 retry_base_delay=60, retry_max_delay=3600, tracer=None, include=None, exclude=None, recorder=None, logger=None):
         super(ObserverHandler, self).__init__()
         self.db_manager = db_manager
-        self.auth_api_token = auth_api_token
+        # The API client is created once and shared, so its connections are reused
+        self.hetzner_dns = hetzner_dns
         self.directory = directory
-        self.observer = observer
+        # Lists the zone files of the directory with one stat per file; include and
+        # exclude are shell patterns of the file names which belong to this handler
+        self.include = include
+        self.exclude = exclude
+        self.scanner = ZoneScanner(directory, include=include, exclude=exclude)
+        # Failed syncs are retried after retry_base_delay seconds, doubled on every attempt up to retry_max_delay
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
         self.logger = logger if logger else logging.getLogger("MyObserverHandler")
+        # Writes one span with the timings of the stages per zone sync (if a trace log is configured)
+        self.tracer = tracer if tracer else Tracer()
+        # Writes every file system event to the event trace (if one is configured); see tools/replay_events.py
+        self.recorder = recorder if recorder else EventRecorder()
+
+        # Index domain => zone id of all zones; only available during a reconciliation
+        self.zone_index = None
+        # Wall clock times of the last successful sync and the last full scan; shown by the status
+        self.last_sync_time = None
+        self.last_scan_time = None
+        # Reason of the last failed sync per worker thread; saved with the retry job
+        self.local = threading.local()
+        # Checkpoint of the directory (generation and device:inode); loaded by the first scan
+        self.generation = None
+        self.directory_identity = None
+
+        # Events are collected per zone and synchronized by a pool of workers once the zone file is quiet.
+        # Every sync goes through the scheduler, so a zone is never synchronized twice at the same time.
+        self.scheduler = SyncScheduler(self.sync_file, debounce_seconds, max_delay, workers)
+
+    # Every event of the observer passes here, also the ones without an on_* method
+    def dispatch(self, event):
+        if self.recorder.enabled():
+            self.recorder.record(event.event_type, os.fsdecode(event.src_path), os.fsdecode(getattr(event, 'dest_path', '') or ''), event.is_directory)
+        super(ObserverHandler, self).dispatch(event)
 
     def on_created(self, event):
         if event.is_directory:
-         return
-        self.check_4_changes()
+            return
+        self.schedule_file(event.src_path)
 
     def on_deleted(self, event):
         if event.is_directory:
             return
-        self.check_4_changes()
+        self.schedule_file(event.src_path)
 
     def on_modified(self, event):
         if event.is_directory:
             return
-        self.check_4_changes()
+        self.schedule_file(event.src_path)
 
-    def check_4_changes(self):
-        # Stop the observer temporarily
-        self.observer.unschedule_all()
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        # A move is a delete of the source and a create of the destination
+        self.schedule_file(event.src_path)
+        self.schedule_file(event.dest_path)
+
+    # Watch another directory or other files; the next scan compares it with the database
+    def set_directory(self, directory, include=None, exclude=None):
+        self.directory = directory
+        self.include = include
+        self.exclude = exclude
+        self.scanner = ZoneScanner(directory, include=include, exclude=exclude)
+        self.generation = None
+
+    # Compare the directory with the checkpoint of the last scan. If the directory was replaced
+    # the stored modification times mean nothing; the next scan checks the digests of all files
+    # (only real changes are uploaded). Returns the time of the last scan.
+    def load_checkpoint(self):
+        generation, identity, last_scan = self.db_manager.get_checkpoint(self.scanner.directory)
+        self.directory_identity = self.scanner.identity()
+
+        if generation is None or identity != self.directory_identity:
+            self.generation = (generation or 0) + 1
+            self.logger.info(f"Directory {self.scanner.directory} is new or was replaced (generation {self.generation}), comparing the digests of all zone files")
+            self.db_manager.reset_modification_times()
+            self.db_manager.save_checkpoint(self.scanner.directory, self.generation, self.directory_identity, None)
+            return None
+
+        self.generation = generation
+        return last_scan
+
+    def is_relevant_file(self, file_name):
+        return self.scanner.is_zone_file(file_name)
+
+    # Hand a changed zone file over to the scheduler; the observer is never blocked by an upload
+    def schedule_file(self, file_path):
+        file_name = os.path.basename(file_path)
+
+        if not self.is_relevant_file(file_name):
+            # File is not relevant; Dosen't need a log entry
+            return
+
+        # A new zone or a deletion comes before the edits of existing zones
+        _, last_checked = self.db_manager.get_file_info(file_name)
+        if last_checked is None or not os.path.exists(os.path.join(self.directory, file_name)):
+            priority = PRIORITY_URGENT
+        else:
+            priority = PRIORITY_INTERACTIVE
+
+        # The trace measures the time from the change of the file to its first event
+        mtime = self.file_mtime(file_name) if self.tracer.enabled() else None
+        self.scheduler.schedule(file_name, priority=priority, mtime=mtime)
+
+    # Modification time of a zone file in seconds or None if it is gone
+    def file_mtime(self, file_name):
+        entry = self.scanner.stat_zone(file_name)
+        return entry.mtime_ns / 1e9 if entry is not None else None
+
+    # Synchronize only the given zone file; called by the scheduler once the zone is quiet
+    def sync_file(self, file_path, waited=None, event_time=None, mtime=None):
+        file_name = os.path.basename(file_path)
+
+        if not self.is_relevant_file(file_name):
+            # File is not relevant; Dosen't need a log entry
+            return
+
+        current_check_time = datetime.now().timestamp()
 
+        # One stat decides between upload and delete and is handed on to the upload
+        entry = self.scanner.stat_zone(file_name)
+        if entry is not None:
+            operation = "upload"
+        else:
+            operation = "delete"
+
+        with self.tracer.span(file_name, operation) as span:
+            if span is not None:
+                if event_time is not None and mtime is not None:
+                    # Time between the change of the file and the first event; the mtime was taken with
+                    # the first event, the current one belongs to the last write of a burst
+                    span.add_stage("detect", event_time - mtime)
+                if waited is not None:
+                    span.add_stage("debounce", waited)
+
+            self.local.error = None
+            try:
+                if operation == "upload":
+                    result = self.sync_zone(file_name, current_check_time, entry)
+                else:
+                    result = self.remove_zone(file_name)
+            except Exception as e:
+                result = self.sync_failed(f"Error synchronizing {file_name}: {str(e)}")
+
+            if span is not None and span.outcome is None:
+                span.outcome = "ok" if result else "failed"
+
+        SYNCS.inc(operation, "success" if result else "failure")
+
+        if result:
+            self.last_sync_time = time.time()
+            # A waiting retry of this zone isn't needed anymore
+            self.db_manager.delete_job(file_name)
+        else:
+            self.queue_retry(file_name, operation, self.local.error)
+
+        return result
+
+    # Log why a sync failed and keep the reason for the retry job; returns False for the caller
+    def sync_failed(self, message):
+        self.logger.error(message)
+        self.local.error = message
+        return False
+
+    # Outcome of the current span if it isn't the plain success or failure
+    def set_outcome(self, outcome):
+        span = self.tracer.current()
+        if span is not None:
+            span.outcome = outcome
+
+    # Upload a zone again although the file is unchanged, e.g. if the zone at Hetzner differs.
+    # Without the modification time, digest and snapshot the next sync sends the whole zone file;
+    # that is stored in the database, so it isn't lost by a restart.
+    def request_resync(self, file_name):
+        with self.db_manager.transaction():
+            self.db_manager.update_file_info(file_name, None, datetime.now().timestamp())
+            self.db_manager.set_digest(file_name, None)
+            self.db_manager.set_snapshot(file_name, None)
+        self.scheduler.schedule(file_name, priority=PRIORITY_BULK)
+
+    # Save a failed sync as job; the job dispatcher hands it back to the scheduler once it is due
+    def queue_retry(self, file_name, operation, error=None):
+        attempts = self.db_manager.get_job_attempts(file_name)
+        delay = min(self.retry_base_delay * (2 ** attempts), self.retry_max_delay)
+
+        self.db_manager.save_job(file_name, operation, time.time() + delay, error)
+        self.logger.info(f"The {operation} of {file_name} failed, next try in {delay} seconds")
+
+    # Upload one zone file if it is new or was modified since the last upload
+    # The entry of the scanner saves another stat if the caller already has one
+    def sync_zone(self, file_name, current_check_time, entry=None):
+        if entry is None:
+            entry = self.scanner.stat_zone(file_name)
+
+        if entry is None:
+            # That could happen if the file was deleted directly after the event
+            return self.sync_failed(f"File {os.path.join(self.directory, file_name)} not found.")
+
+        file_path = entry.path
+        # Nanoseconds; two writes within the same second must not look like one. Values of
+        # older versions are in seconds and never match; the digest check avoids the upload then,
+        # but rows from before the digests were stored have none, so those zones are uploaded once.
+        last_modified_file = entry.mtime_ns
+        last_modified_db, last_checked = self.db_manager.get_file_info(file_name)
+
+        # The file was checked before and is unchanged => just update the check time
+        if last_checked is not None and last_modified_db == last_modified_file:
+            FILES_SKIPPED.inc("unchanged_mtime")
+            self.set_outcome("unchanged")
+            if not self.db_manager.update_file_info(file_name, last_modified_file, current_check_time):
+                return self.sync_failed(f"Could not update file {file_name} in database.")
+            return True
+
+        # The modification time changed; CWP and named often rewrite a file without changing it,
+        # so only upload if the normalized content is different from the last upload
+        digest = zone_digest(file_path)
+        if last_checked is not None and digest is not None and digest == self.db_manager.get_digest(file_name):
+            self.logger.info(f"Content of {file_name} is unchanged, skipping upload")
+            FILES_SKIPPED.inc("unchanged_content")
+            self.set_outcome("unchanged")
+            if not self.db_manager.update_file_info(file_name, last_modified_file, current_check_time):
+                return self.sync_failed(f"Could not update file {file_name} in database.")
+            return True
+
+        # The file is new, was never checked or was modified
+        # Getting domain from file name
+        domain = self.hetzner_dns.get_domain(file_name)
+
+        with self.tracer.stage("zone_id"):
+            zone_id = self.get_zone_id(file_name, domain)
+        if zone_id is None: # Now we should have a zone id; if not, there is a problem in the DNS app.
+            return self.sync_failed(f"Could not create new zone {domain}")
+
+        # Now we can updating the zone data
+        try:
+            with self.tracer.stage("upload"):
+                uploaded = self.upload_zone(file_name, zone_id, domain, file_path)
+        except ZoneNotFoundError:
+            # The cached zone id is outdated; forget it and try once again with a fresh one
+            self.logger.info(f"Zone id {zone_id} of {domain} is unknown, looking it up again")
+            self.db_manager.set_zone_id(file_name, None)
+            with self.tracer.stage("zone_id"):
+                zone_id = self.get_zone_id(file_name, domain, use_cache=False)
+            if zone_id is None:
+                return self.sync_failed(f"Could not create new zone {domain}")
+            try:
+                # The records of the old zone are gone; send the whole zone file
+                with self.tracer.stage("upload"):
+                    uploaded = self.upload_zone(file_name, zone_id, domain, file_path, full_import=True)
+            except ZoneNotFoundError:
+                uploaded = False
+
+        if not uploaded:
+            # The details are logged by the API client;
+            # we just don't update the database and can try it the next time
+            return self.sync_failed(f"Upload of zone {domain} failed")
+
+        # Adding or updating the file in the database with a single commit
+        with self.tracer.stage("db"), self.db_manager.transaction():
+            if last_checked is None:
+                result = self.db_manager.insert_file_info(file_name, last_modified_file, current_check_time, zone_id, digest)
+            else:
+                result = self.db_manager.update_file_info(file_name, last_modified_file, current_check_time) \
+                     and self.db_manager.set_zone_id(file_name, zone_id) \
+                     and self.db_manager.set_digest(file_name, digest)
+
+        if not result:
+            return self.sync_failed(f"Could not save file {file_name} in database.")
+
+        return True
+
+    # Get the zone id from the database or the zone index of a full scan;
+    # only ask the API if we don't know it yet
+    def get_zone_id(self, file_name, domain, use_cache=True):
+        zone_index = self.zone_index
+
+        if use_cache:
+            zone_id = self.db_manager.get_zone_id(file_name)
+            if zone_id is not None:
+                return zone_id
+
+        if zone_index is not None:
+            # The index contains all zones of the account; if the domain is missing we can create it directly
+            zone_id = zone_index.get(domain)
+        else:
+            # Try to get a zone ID; the zone may already exist and only the database entry was missing
+            zone_id = self.hetzner_dns.get_zone_id(domain)
+
+        if zone_id is None:  # We don't have an existing zone
+            zone_id = self.hetzner_dns.create_zone(domain)
+            # A new zone is empty; the records of the last upload are worthless
+            self.db_manager.set_snapshot(file_name, None)
+
+        return zone_id
+
+    # Send the changes of a zone file to Hetzner. If we know the records of the last upload
+    # only the changed records will be sent; otherwise (or if that fails) the whole zone file.
+    def upload_zone(self, file_name, zone_id, domain, file_path, full_import=False):
+        try:
+            # Parsed line by line from the file; only the records are kept in memory
+            with open(file_path, 'r', encoding='utf-8') as file:
+                records = parse_zone(file, domain)
+        except (OSError, UnicodeDecodeError, ZoneParseError) as e:
+            self.logger.info(f"Could not parse {file_name}, using the full import: {str(e)}")
+            records = None
+
+        snapshot = None if full_import else self.db_manager.get_snapshot(file_name)
+
+        if records is not None and snapshot is not None:
+            additions, updates, deletions = diff_records(snapshot, records)
+            changes = len(additions) + len(updates) + len(deletions)
+
+            # If most of the zone changed the import is cheaper than single records
+            if changes <= max(1, len(records) // 2):
+                if changes == 0 or self.hetzner_dns.update_zone_records(zone_id, additions, updates, deletions):
+                    self.logger.info(f"Zone {domain} updated: {len(additions)} added, {len(updates)} updated, {len(deletions)} deleted")
+                    self.db_manager.set_snapshot(file_name, records)
+                    return True
+                self.logger.info(f"Could not update the records of {domain}, using the full import")
+
+        if not self.hetzner_dns.update_zone_from_file(zone_id, domain, file_path):
+            return False
+
+        self.db_manager.set_snapshot(file_name, records)
+        return True
+
+    # Delete the zone of a removed zone file
+    def remove_zone(self, file_name):
+        zone_index = self.zone_index
+
+        last_modified_db, last_checked = self.db_manager.get_file_info(file_name)
+
+        if last_checked is None:
+            # We never uploaded this file => nothing to delete
+            self.set_outcome("unchanged")
+            return True
+
+        # Getting domain from filename
+        domain = self.hetzner_dns.get_domain(file_name)
+
+        # Seaching the zone id; the cached one saves a request
+        with self.tracer.stage("zone_id"):
+            zone_id = self.db_manager.get_zone_id(file_name)
+            if zone_id is None and zone_index is not None:
+                zone_id = zone_index.get(domain)
+            elif zone_id is None:
+                zone_id = self.hetzner_dns.get_zone_id(domain)
+
+        if zone_id: # We found a zone id
+            # Deleting the zone id
+            with self.tracer.stage("upload"):
+                deleted = self.hetzner_dns.delete_zone(zone_id)
+            if not deleted:
+                return self.sync_failed(f"Could not delete zone {domain} from Hetzner DNS.")
+
+        # It doesn't matter if we found a zone id, we will delete the file entry in the data
+        # base because we assuming that the api is working and we getting the data from it
+        with self.tracer.stage("db"):
+            deleted = self.db_manager.delete_file_info(file_name)
+        if not deleted:
+            return self.sync_failed(f"Could not delete file {file_name} from database.")
+
+        return True
+
+    # Full reconciliation of the directory with the database; runs periodically
+    # to catch changes which were missed by the file system events.
+    # The observer stays attached; events during the scan are collected by the scheduler.
+    @SCAN_DURATION.time()
+    def check_4_changes(self):
         current_check_time = datetime.now().timestamp()
-        hetzner_dns = HetznerDNS(self.auth_api_token)
-
-        file_list = os.listdir(self.directory)
-        for file_name in file_list:
-            # Use an absolute path to the file
-            file_path = os.path.abspath(os.path.join(self.directory, file_name))
-
-            if not file_name.endswith('.db') \
-            or not os.path.isfile(file_path) \
-            or file_name == "hydrogen.ns.hetzner.com.db" \
-            or file_name == "oxygen.ns.hetzner.com.db"\
-            or file_name == "helium.ns.hetzner.com.db":
-                # File/directory is not relevant; Dosen't need a log entry
-                continue
-
-            if not os.path.exists(file_path):
-                # That should never happen, because we read the directory directly before but who knows :-)
-                self.logger.error(f"File {file_path} not found.")
-                continue
-
-            last_modified_file = int(os.path.getmtime(file_path))
-            last_modified_db, last_checked = self.db_manager.get_file_info(file_name)
-
-            # Checking if the file was ever checked
-            if last_checked == None:
-                # The file was never checked => it could be a new zone or a file that was never checked before
-                # Getting domain from file name
-                domain = hetzner_dns.get_domain(file_name)
-
-                # Try to get a zone ID; the zone may already exist and only the database entry was missing
-                zone_id = hetzner_dns.get_zone_id(domain)
-
-                if zone_id == None:  # We don't have an existing zone
-                    domain = hetzner_dns.create_zone(domain)
-
-                if zone_id == None: # Now we should have a zone id; if not, there is a problem in the DNS app.
-                    self.logger.error("Could not create a new zone")
-                    continue  # Continue to the next file
-
-                # Now we can updating the zone data
-                if not hetzner_dns.update_zone_from_file(zone_id, domain, file_name):
-                    # The log will be written within the method update_zone_from_file
-                    # we just need to contiue to not update the database and can try it the next time
-                    continue  # Continue to the next file
-
-                # Adding new file to the database
-                if not self.db_manager.insert_file_info(file_name, last_modified_file, current_check_time):
-                    self.logger.error(f"Could not insert file {file_name} in database.")
-                    continue # Continue to the next file
-
-            # Checking if the file was modified
-            elif last_modified_db == last_modified_file:
+
+        if self.generation is None:
+            last_scan = self.load_checkpoint()
+            if last_scan:
+                self.logger.info(f"Last scan of {self.directory} was at {datetime.fromtimestamp(last_scan)}")
+
+        plan = self.plan_changes(current_check_time)
+        changed_files = self.start_changes(plan)
+        self.scheduler.wait_for(changed_files)
+        self.finish_scan()
+
+    # Compare the directory with the database without changing anything
+    def plan_changes(self, current_check_time):
+        new_files = []
+        modified_files = []
+        unchanged_files = []
+
+        # Load the whole table once instead of one query per file
+        file_infos = self.db_manager.get_all_file_info()
+        present_files = set()
+
+        # The scanner only returns the relevant zone files
+        for entry in self.scanner.scan():
+            file_name = entry.name
+            present_files.add(file_name)
+            last_modified_file = entry.mtime_ns
+            last_modified_db, last_checked = file_infos.get(file_name, (None, None))
+
+            if last_checked is not None and last_modified_db == last_modified_file:
                 # No modification found => just update the check time
-                print("Just update the check time")
-                if not self.db_manager.update_file_info(file_name, last_modified_file, current_check_time):
-                    self.logger.error("Could not update file {file_name} in database.")
-                    continue # Continue to the next file
-
-            # changes that younger then last check and the last check scould be at least 2 seconds in the past
-            # We checking for the two seconds, because the dns update from the CWP7 frontend trigger several
-            # changes in the directory but we want only to send one update. Dont SPAM the API :-)
-            elif last_modified_file > last_checked \
-            and  last_modified_file != last_modified_db \
-            and  last_checked < current_check_time - 2:
-                # Found a changed file that is relevant
-                domain = hetzner_dns.get_domain(file_name)
-
-                # Try to get a zone ID; the zone may already exist
-                zone_id = hetzner_dns.get_zone_id(domain)
-
-                if zone_id == None: # Now we schould have a zone id; if not go on
-                    domain = hetzner_dns.create_zone(domain)
-
-                if zone_id == None: # Now we should have a zone id; if not, there is a problem in the DNS app.
-                    self.logger.error("Could not create new zone")
-                    continue # Continue to the next file
-
-                # Updating the zone data
-                hetzner_dns.update_zone_from_file(zone_id, domain, file_name)
-                if not hetzner_dns.update_zone_from_file(zone_id, domain, file_name):
-                    # The log will be written within the method update_zone_from_file
-                    # we just need to contiue to not update the database and can try it the next time
-                    continue  # Continue to the next file
-
-                # Updating the database
-                if not self.db_manager.update_file_info(file_name, last_modified_file, current_check_time):
-                    self.logger.error(f"Could not update file {file_name} in database.")
-                    continue # Continue to the next file
+                unchanged_files.append((file_name, last_modified_file, current_check_time))
+            elif file_name in file_infos:
+                modified_files.append(file_name)
+            else:
+                new_files.append(file_name)
+
+        FILES_SCANNED.inc(amount=len(present_files))
 
+        # Files in the database which aren't in the directory anymore were deleted. Files which are
+        # left out by the filters now are only forgotten; their zones stay at Hetzner.
+        deleted_files = []
+        filtered_files = []
+        for file_name in set(file_infos) - present_files:
+            if self.is_relevant_file(file_name):
+                deleted_files.append(file_name)
             else:
-                # In any other case Just updating the check time. I have no idea which case it could be but let us make the program robust :-)   
-                if not self.db_manager.update_file_info(file_name, last_modified_file, current_check_time):
-                    self.logger.error(f"Could not update file {file_name} in database.")
-                    continue # Continue to the next file
-
-        # Now checking the files in the database which weren't updated
-        # That could happen if the file was deleted
-        # First, get all relevant files
-        files_in_db = self.db_manager.get_files_not_checked_since(current_check_time)
-
-        # All files where updated => Nothing to do
-        if not files_in_db:
-            return
+                filtered_files.append(file_name)
+
+        return ScanPlan(new_files, modified_files, deleted_files, unchanged_files, filtered_files)
+
+    # Write the check times of the plan and hand its changes to the workers; returns the scheduled files
+    def start_changes(self, plan):
+        FILES_SKIPPED.inc("unchanged_mtime", amount=len(plan.unchanged))
+
+        # Write the check time of all unchanged files with one commit
+        if not self.db_manager.update_check_times(plan.unchanged):
+            self.logger.error("Could not update the check times in database.")
+
+        for file_name in plan.filtered:
+            self.logger.info(f"{file_name} is filtered out, forgetting it")
+            self.db_manager.delete_file_info(file_name)
+
+        # Fetch all zones once instead of searching every new zone on its own; the zones we know
+        # have their id in the database. If the list isn't available we fall back to the single search.
+        if len(plan.new) > 1:
+            self.zone_index = self.hetzner_dns.get_all_zones()
+
+        # Let the workers synchronize all changes in parallel.
+        # New and deleted zones go first, the modified ones drain behind the live edits.
+        for file_name in plan.new + plan.deleted:
+            self.scheduler.schedule(file_name, immediate=True, priority=PRIORITY_URGENT)
+        for file_name in plan.modified:
+            self.scheduler.schedule(file_name, immediate=True, priority=PRIORITY_BULK)
+
+        return plan.new + plan.deleted + plan.modified
 
-        # Checking all entries in the database
-        for file_name in files_in_db:
-            # Use an absolute path to the file
-            file_path = os.path.abspath(os.path.join(self.directory, file_name[0]))
-
-            # Check if the file still exists on the file system
-            if not os.path.exists(file_path): # File was deleted
-                # Getting domain from filename
-                domain = hetzner_dns.get_domain(file_name[0])
-
-                # Seaching the zone id
-                zone_id = hetzner_dns.get_zone_id(domain)
-
-                if zone_id: # We found a zone id
-                     # Deleting the zone id
-                    if not hetzner_dns.delete_zone(domain):
-                        self.logger.error(f"Could not delete zone {domain} from Hetzner DNS.")
-                        continue  # Continue to the next file
-                # It doesn't matter if we found a zone id, we will delete the file entry in the data
-                # base because we assuming that the api is working and we getting the data from it
-                if not self.db_manager.delete_file_info(file_name[0]):
-                    self.logger.error(f"Could not delete file {file_name[0]} from database.")
-                    continue  # Continue to the next file
-
-        # Start the observer again
-        self.observer.schedule(self, path=self.directory, recursive=False)
+    # The scheduled changes are done; remember the scan in the checkpoint
+    def finish_scan(self):
+        self.zone_index = None
+        self.last_scan_time = time.time()
+        self.db_manager.save_checkpoint(self.scanner.directory, self.generation, self.directory_identity, self.last_scan_time)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import threading
+import time
+from modules.metrics import API_RATE
+
+# Token bucket shared by all workers; keeps the total request rate below the API limit.
+# The rate adapts to the RateLimit-* headers of the API: it is lowered when the remaining
+# quota runs short, all requests pause on 429 and the full rate is back after the reset.
+class RateLimiter:
+    def __init__(self, rate, burst=None, target=""):
+        # Name of the watch target; the label of the rate metric
+        self.target = target
+        # Configured requests per second; the upper bound of the adaptive rate
+        self.max_rate = float(rate)
+        # Requests per second right now
+        self.rate = self.max_rate
+        # Number of requests which may be sent at once after a quiet period
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+        # No request is sent before this time (after a 429 or an exhausted quota)
+        self.blocked_until = 0.0
+        # The full rate is allowed again at this time
+        self.reset_time = 0.0
+        self.lock = threading.Lock()
+        API_RATE.set(self.rate, self.target)
+
+    def refill(self, now):
+        if now >= self.reset_time and self.rate < self.max_rate:
+            # The quota of the API was reset
+            self.set_rate(self.max_rate)
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def set_rate(self, rate):
+        self.rate = rate
+        API_RATE.set(rate, self.target)
+
+    # Block until a request may be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait_time = self.blocked_until - now
+                else:
+                    self.refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    # Adjust the rate to the headers of a response; called for every response of the API
+    def update_from_headers(self, headers, status_code=None):
+        remaining = header_number(headers, "RateLimit-Remaining")
+        reset = header_seconds(headers, "RateLimit-Reset")
+        limit = header_number(headers, "RateLimit-Limit")
+        retry_after = header_seconds(headers, "Retry-After")
+
+        with self.lock:
+            now = time.monotonic()
+            if reset is not None:
+                self.reset_time = now + reset
+
+            if status_code == 429:
+                # Too many requests; nobody sends anything until the API allows it again
+                pause = retry_after if retry_after is not None else (reset if reset is not None else 1.0)
+                self.blocked_until = max(self.blocked_until, now + max(pause, 0.1))
+                self.reset_time = max(self.reset_time, self.blocked_until)
+                self.tokens = 0.0
+                return
+
+            if remaining is None or reset is None:
+                return
+
+            if remaining <= 0:
+                # The quota is used up; wait for the reset
+                self.blocked_until = max(self.blocked_until, now + reset)
+                self.tokens = 0.0
+                return
+
+            # Keep the full rate while there is plenty left; below the low water mark
+            # the remaining requests are spread over the time until the reset
+            low_water = max(self.burst, (limit or 0) * 0.1)
+            if remaining > low_water:
+                rate = self.max_rate
+            else:
+                rate = min(self.max_rate, remaining / max(reset, 1.0))
+            if rate != self.rate:
+                self.refill(now)
+                self.set_rate(rate)
+                self.tokens = min(self.tokens, max(1.0, remaining - 1))
+
+def header_number(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+# Seconds until the given time; the header contains either seconds or a unix timestamp
+def header_seconds(headers, name):
+    seconds = header_number(headers, name)
+    if seconds is not None and seconds > 1000000000:
+        seconds = seconds - time.time()
+    return max(0.0, seconds) if seconds is not None else None
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import os
+import json
+import logging
+import threading
+import socketserver
+
+# Answers every connection to the unix socket with the status of the daemon as one JSON
+# object and closes it; no request needs to be sent. Used by configGet.py and the CWP page
+# instead of starting a process for every page view.
+class StatusRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            status = self.server.status_function()
+        except Exception as e:
+            status = {"active": True, "error": f"Error getting the status: {str(e)}"}
+        self.wfile.write(json.dumps(status).encode('utf-8') + b"\n")
+
+class StatusUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class StatusServer:
+    def __init__(self, socket_path, status_function, logger=None):
+        self.socket_path = socket_path
+        # Returns the status as dict
+        self.status_function = status_function
+        self.logger = logger if logger else logging.getLogger("StatusServer")
+        self.server = None
+
+    def start(self):
+        try:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = StatusUnixServer(self.socket_path, StatusRequestHandler)
+            # Only root may ask, like it may read config.json; the CWP page and configGet.py run as root.
+            # The status shows the directories and targets of all accounts of the server.
+            os.chmod(self.socket_path, 0o600)
+        except OSError as e:
+            self.logger.error(f"Error starting the status server: {str(e)}")
+            self.server = None
+            return False
+
+        self.server.status_function = self.status_function
+        threading.Thread(target=self.server.serve_forever, name="StatusServer", daemon=True).start()
+        return True
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Priorities of the zones; a lower number is synchronized first
+# New zones and deletions; a customer waits for them
+PRIORITY_URGENT = 0
+# Changes of existing zones reported by the watcher
+PRIORITY_INTERACTIVE = 1
+# Changes found by the reconciliation, retries and resyncs of the verifier
+PRIORITY_BULK = 2
+PRIORITIES = [PRIORITY_URGENT, PRIORITY_INTERACTIVE, PRIORITY_BULK]
+
+# Collects the file system events per zone and triggers exactly one sync per zone
+# after the zone file was quiet for a while. The dns update from the CWP7 frontend
+# rewrites a zone file several times, but we want only to send one update.
+# The syncs run in a pool of workers; a zone is never synchronized by two workers at once.
+# Zones which are due wait in one queue per priority and are handed to a worker only when one
+# is free, so a new zone doesn't wait behind thousands of bulk updates. Every fair_share-th
+# sync is taken from a lower priority, so the bulk work still drains during a stream of edits.
+class SyncScheduler:
+    def __init__(self, sync_function, quiet_window=2, max_delay=30, workers=4, fair_share=4, logger=None):
+        self.sync_function = sync_function
+        # Seconds without a new event before a zone will be synchronized
+        self.quiet_window = quiet_window
+        # Seconds after the first event when a zone will be synchronized even if events are still coming
+        self.max_delay = max_delay
+        self.workers = workers
+        self.fair_share = max(2, fair_share)
+        self.logger = logger if logger else logging.getLogger("SyncScheduler")
+
+        # Zones in their quiet window or waiting for their sync in flight:
+        # file name => (time of the first event, time of the last event, sync without waiting,
+        #               wall clock time of the first event, priority, mtime of the file at the first event)
+        self.pending = {}
+        # Zones which are due: file name => (priority, time of the first event, wall clock time of the first event,
+        #                                    mtime of the file at the first event)
+        self.ready = {}
+        # Queue per priority of (time of the first event, sequence, file name); entries whose
+        # priority doesn't match self.ready anymore are skipped
+        self.queues = {priority: [] for priority in PRIORITIES}
+        self.sequence = itertools.count()
+        # Number of handed out syncs and of the turns of the lower priorities
+        self.picks = 0
+        self.fair_turns = 0
+        # Zones which are synchronized by a worker right now
+        self.in_flight = set()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.executor = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="SyncWorker")
+        self.thread = threading.Thread(target=self.run, name="SyncScheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+    # Register an event for a zone file; repeated events only extend the quiet window.
+    # With immediate=True the zone is synchronized as soon as a worker is free.
+    # A zone keeps the highest priority of all its events. The mtime of the file (seconds, if known)
+    # is kept from the first event; with the later events of a burst the file has a later one.
+    def schedule(self, file_name, immediate=False, priority=PRIORITY_INTERACTIVE, mtime=None):
+        now = time.monotonic()
+        with self.condition:
+            if file_name in self.ready:
+                ready_priority, first_seen, event_time, first_mtime = self.ready[file_name]
+                if priority < ready_priority:
+                    self.make_ready(file_name, priority, first_seen, event_time, first_mtime)
+                return
+
+            first_seen, _, was_immediate, event_time, pending_priority, first_mtime = self.pending.get(file_name, (now, now, False, time.time(), priority, mtime))
+            self.pending[file_name] = (first_seen, now, immediate or was_immediate, event_time, min(priority, pending_priority), first_mtime)
+            self.condition.notify_all()
+
+    def make_ready(self, file_name, priority, first_seen, event_time, mtime):
+        self.ready[file_name] = (priority, first_seen, event_time, mtime)
+        heapq.heappush(self.queues[priority], (first_seen, next(self.sequence), file_name))
+
+    def pending_count(self):
+        with self.condition:
+            return len(self.pending) + len(self.ready)
+
+    # Block until none of the given zones is pending or synchronized anymore or the timeout is over.
+    # Returns the number of the given zones which aren't done yet.
+    def wait_for(self, file_names, timeout=None):
+        file_names = set(file_names)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            while self.running and self.count_waiting(file_names):
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                self.condition.wait(1 if deadline is None else min(1, max(0.0, deadline - time.monotonic())))
+            return self.count_waiting(file_names)
+
+    # Number of the given zones which are pending, due or synchronized right now; the condition must be held
+    def count_waiting(self, file_names):
+        return len(file_names & self.pending.keys()) + len(file_names & self.ready.keys()) + len(file_names & self.in_flight)
+
+    # Block until all pending zones are synchronized, e.g. before the watched directory is swapped
+    def wait_idle(self):
+        with self.condition:
+            while self.running and (self.pending or self.ready or self.in_flight):
+                self.condition.wait(1)
+
+    # Move the zones whose quiet window is over into the queues. Zones with a sync in flight
+    # stay pending until the worker is done. Returns the seconds until the next one will be due.
+    def collect_due(self, now):
+        next_due = None
+
+        for file_name, (first_seen, last_seen, immediate, event_time, priority, mtime) in list(self.pending.items()):
+            if file_name in self.in_flight:
+                continue
+
+            if immediate:
+                due_time = now
+            else:
+                due_time = min(last_seen + self.quiet_window, first_seen + self.max_delay)
+
+            if due_time <= now:
+                del self.pending[file_name]
+                self.make_ready(file_name, priority, first_seen, event_time, mtime)
+            elif next_due is None or due_time - now < next_due:
+                next_due = due_time - now
+
+        return next_due
+
+    # Drop the outdated entries at the head of a queue; True if a zone is waiting in it
+    def queue_waiting(self, priority):
+        queue = self.queues[priority]
+        while queue:
+            file_name = queue[0][2]
+            if file_name in self.ready and self.ready[file_name][0] == priority:
+                return True
+            heapq.heappop(queue)
+        return False
+
+    # The next zone to synchronize as (file name, time of the first event, wall clock time of the first event,
+    # mtime of the file at the first event)
+    def next_ready(self):
+        waiting = [priority for priority in PRIORITIES if self.queue_waiting(priority)]
+        if not waiting:
+            return None
+
+        self.picks += 1
+        if len(waiting) > 1 and self.picks % self.fair_share == 0:
+            # Turn of the lower priorities, one after the other
+            priority = waiting[1 + self.fair_turns % (len(waiting) - 1)]
+            self.fair_turns += 1
+        else:
+            priority = waiting[0]
+
+        _, _, file_name = heapq.heappop(self.queues[priority])
+        _, first_seen, event_time, mtime = self.ready.pop(file_name)
+        return file_name, first_seen, event_time, mtime
+
+    # Returns up to limit zones which are due as (file name, time of the first event, wall clock time
+    # of the first event, mtime at the first event) and the seconds until the next one will be due.
+    def pop_due(self, now, limit=None):
+        next_due = self.collect_due(now)
+
+        due = []
+        while limit is None or len(due) < limit:
+            entry = self.next_ready()
+            if entry is None:
+                break
+            due.append(entry)
+
+        return due, next_due
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+
+                # Only as many zones as there are free workers; the others keep their place in the queues
+                due, next_due = self.pop_due(time.monotonic(), self.workers - len(self.in_flight))
+                if not due:
+                    # Wait for the next zone to become due, a new event or a finished worker
+                    self.condition.wait(next_due)
+                    continue
+
+                self.in_flight.update(entry[0] for entry in due)
+
+            for file_name, first_seen, event_time, mtime in due:
+                self.executor.submit(self.run_sync, file_name, first_seen, event_time, mtime)
+
+    # The sync function gets the seconds the zone waited since its first event, the time of that
+    # event and the mtime of the file at that time
+    def run_sync(self, file_name, first_seen, event_time, mtime):
+        try:
+            self.sync_function(file_name, time.monotonic() - first_seen, event_time, mtime)
+        except Exception as e:
+            # Never let one broken zone stop the worker
+            self.logger.error(f"Error synchronizing {file_name}: {str(e)}")
+        finally:
+            with self.condition:
+                self.in_flight.discard(file_name)
+                self.condition.notify_all()
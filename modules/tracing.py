@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Value below which the given share (0.0 - 1.0) of the values lies, e.g. 0.95 for p95; used by
+# the tools which summarise the spans
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+# One span per zone sync with the time of every stage (detect, debounce, zone_id, upload, db)
+# and the outcome. The finished spans are written as one JSON object per line.
+class Span:
+    def __init__(self, zone, operation):
+        self.zone = zone
+        self.operation = operation
+        self.start_time = time.time()
+        self.stages = {}
+        self.outcome = None
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + max(0.0, seconds)
+
+    def to_dict(self):
+        return {
+            "time": round(self.start_time, 6),
+            "zone": self.zone,
+            "operation": self.operation,
+            "outcome": self.outcome,
+            "total": round(sum(self.stages.values()), 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()}
+        }
+
+class Tracer:
+    def __init__(self, log_path="", logger=None):
+        # Without a path the tracer does nothing
+        self.log_path = log_path
+        self.logger = logger if logger else logging.getLogger("Tracer")
+        self.lock = threading.Lock()
+        # Every worker thread synchronizes one zone at a time; its span is kept per thread
+        self.local = threading.local()
+        self.log_file = None
+
+        if self.log_path:
+            try:
+                self.log_file = open(self.log_path, 'a')
+            except OSError as e:
+                self.logger.error(f"Error opening the trace log {self.log_path}: {str(e)}")
+
+    def enabled(self):
+        return self.log_file is not None
+
+    def close(self):
+        with self.lock:
+            if self.log_file:
+                self.log_file.close()
+                self.log_file = None
+
+    def current(self):
+        return getattr(self.local, 'span', None)
+
+    # Open a span for the sync of a zone in the current thread
+    @contextmanager
+    def span(self, zone, operation):
+        if not self.enabled():
+            yield None
+            return
+
+        span = Span(zone, operation)
+        self.local.span = span
+        try:
+            yield span
+        finally:
+            self.local.span = None
+            self.write(span)
+
+    # Measure a stage of the current span; does nothing without a span
+    @contextmanager
+    def stage(self, stage):
+        span = self.current()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            if span is not None:
+                span.add_stage(stage, time.perf_counter() - start_time)
+
+    def write(self, span):
+        line = json.dumps(span.to_dict())
+        with self.lock:
+            if self.log_file is None:
+                return
+            try:
+                self.log_file.write(line + "\n")
+                self.log_file.flush()
+            except OSError as e:
+                self.logger.error(f"Error writing the trace log: {str(e)}")
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import time
+import logging
+import threading
+from watchdog.observers import Observer
+from modules.drift_verifier import DriftVerifier
+from modules.hetzner_dns import HetznerDNS
+from modules.inotify_watcher import InotifyWatcher
+from modules.job_dispatcher import JobDispatcher
+from modules.observer_handler import ObserverHandler
+from modules.rate_limiter import RateLimiter
+
+# Settings of the API client; if one of them changes on a reload a new client is created
+CLIENT_SETTINGS = ["apiToken", "apiUrl", "poolSize", "connectTimeout", "readTimeout", "maxRetries",
+                   "backoffFactor", "compressUploads", "rateLimit", "rateBurst"]
+
+# Settings of the watched files; if one of them changes on a reload the watcher is replaced
+WATCH_SETTINGS = ["directory", "include", "exclude", "watcherBackend"]
+
+# Create the API client; it keeps its connections open for all uploads.
+# The metrics of the client and its rate limiter carry the name of the target.
+def create_client(config, rate_limiter=None, target=""):
+    return HetznerDNS(config['apiToken'],
+                      pool_size=int(config['poolSize']),
+                      connect_timeout=float(config['connectTimeout']),
+                      read_timeout=float(config['readTimeout']),
+                      max_retries=int(config['maxRetries']),
+                      backoff_factor=float(config['backoffFactor']),
+                      rate_limiter=rate_limiter if rate_limiter else RateLimiter(float(config['rateLimit']), float(config['rateBurst']), target),
+                      api_url=config['apiUrl'],
+                      compress_uploads=bool(config['compressUploads']),
+                      target=target)
+
+# Create the watcher of the zone directory for the configured backend; reconcile is called if inotify lost events
+def create_observer(handler, named_directory, backend, logger=None, reconcile=None):
+    my_logger = logger if logger else logging.getLogger("hetznerDnsUpdate")
+
+    if backend == "inotify":
+        if InotifyWatcher.available():
+            return InotifyWatcher(handler, named_directory, reconcile)
+        my_logger.warning("inotify is not available, using watchdog")
+    elif backend != "watchdog":
+        my_logger.warning(f"Unknown watcher backend '{backend}', using watchdog")
+
+    observer = Observer()
+    observer.schedule(handler, path=named_directory, recursive=False)
+    return observer
+
+# One watched directory which is synchronized to one Hetzner account. Every target has its own
+# API client with its own rate limit, its own workers, retry jobs and reconciliation thread;
+# a throttled or unreachable account doesn't hold up the other targets. The database is
+# shared, its rows are kept apart by the name of the target.
+class WatchTarget:
+    def __init__(self, name, config, db_manager, tracer=None, recorder=None, logger=None):
+        self.name = name
+        self.config = config
+        self.logger = logger if logger else logging.getLogger(f"WatchTarget.{name}" if name else "WatchTarget")
+        self.db_manager = db_manager.for_target(name)
+
+        self.handler = ObserverHandler(self.db_manager, create_client(config, target=name), config['directory'],
+                                       debounce_seconds=float(config['debounceSeconds']),
+                                       workers=int(config['workers']),
+                                       retry_base_delay=float(config['retryBaseDelay']),
+                                       retry_max_delay=float(config['retryMaxDelay']),
+                                       tracer=tracer,
+                                       recorder=recorder,
+                                       include=config.get('include'),
+                                       exclude=config.get('exclude'))
+        self.observer = None
+        self.dispatcher = None
+        self.verifier = None
+
+        # Serializes the reconciliation and the swap of the directory
+        self.lock = threading.Lock()
+        # Wakes up the reconciliation thread for a scan or the stop
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        # The scheduler synchronizes the zones collected by the observer handler
+        self.handler.scheduler.start()
+
+        # The dispatcher retries the failed uploads stored in the database
+        self.dispatcher = JobDispatcher(self.db_manager, self.handler.scheduler)
+        self.dispatcher.start()
+
+        # Find zones which were changed at Hetzner in the background
+        if float(self.config['verifyCyclePeriod']) > 0:
+            self.verifier = DriftVerifier(self.handler,
+                                          cycle_period=float(self.config['verifyCyclePeriod']),
+                                          max_requests=float(self.config['verifyMaxRequests']))
+            self.verifier.start()
+
+        self.observer = create_observer(self.handler, self.config['directory'], self.config['watcherBackend'], self.logger, self.reconcile)
+        self.observer.start()
+
+        # Catch up with the changes while the daemon was stopped, then reconcile periodically
+        self.thread = threading.Thread(target=self.run, name=f"Reconcile-{self.name}" if self.name else "Reconcile", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+        if self.verifier:
+            self.verifier.stop()
+            self.verifier.join()
+        if self.dispatcher:
+            self.dispatcher.stop()
+            self.dispatcher.join()
+        self.handler.scheduler.stop()
+        self.handler.scheduler.join()
+        if self.thread:
+            self.thread.join()
+        self.handler.hetzner_dns.close()
+
+    # Full scan of the directory; after the start and every reconcileInterval seconds
+    def run(self):
+        next_scan = time.monotonic()
+        while True:
+            self.wakeup.wait(max(0.0, next_scan - time.monotonic()))
+            self.wakeup.clear()
+            if self.stopped:
+                return
+
+            with self.lock:
+                try:
+                    self.handler.check_4_changes()
+                except Exception as e:
+                    self.logger.error(f"Error reconciling {self.config['directory']}: {str(e)}")
+            next_scan = time.monotonic() + float(self.config['reconcileInterval'])
+
+    # Scan the directory now
+    def reconcile(self):
+        self.wakeup.set()
+
+    # Take over a changed configuration. A new token or API setting swaps the client of the handler,
+    # a new directory or filter swaps the watcher once the pending zones are synchronized.
+    # Workers and the other settings need a restart.
+    def reload(self, config):
+        if any(config[key] != self.config[key] for key in CLIENT_SETTINGS):
+            old_client = self.handler.hetzner_dns
+            same_rate = config['rateLimit'] == self.config['rateLimit'] and config['rateBurst'] == self.config['rateBurst']
+            self.handler.hetzner_dns = create_client(config, old_client.rate_limiter if same_rate else None, self.name)
+            # Requests in flight finish on their connection, which is closed when it is given back;
+            # the idle connections of the old pool are closed now
+            old_client.close()
+            self.logger.info("API client replaced")
+
+        if any(config.get(key) != self.config.get(key) for key in WATCH_SETTINGS):
+            with self.lock:
+                self.observer.stop()
+                self.observer.join()
+                self.handler.scheduler.wait_idle()
+
+                self.handler.set_directory(config['directory'], config.get('include'), config.get('exclude'))
+                self.observer = create_observer(self.handler, config['directory'], config['watcherBackend'], self.logger, self.reconcile)
+                self.observer.start()
+            self.logger.info(f"Watching {config['directory']} now")
+
+        # The name identifies the target and is never changed by a reload
+        changed = [key for key in config if key not in CLIENT_SETTINGS + WATCH_SETTINGS + ["name"] and config[key] != self.config.get(key)]
+        if changed:
+            self.logger.info(f"Changed settings which need a restart: {', '.join(changed)}")
+
+        self.config = config
+        # Catch up with the (new) directory
+        self.reconcile()
+
+    def status(self):
+        zone_files, zones = self.db_manager.count_file_info()
+
+        return {
+            "name": self.name,
+            "directory": self.config.get("directory", ""),
+            "watcherBackend": self.config.get("watcherBackend", ""),
+            "workers": self.config.get("workers"),
+            "reconcileInterval": self.config.get("reconcileInterval"),
+            "zoneFiles": zone_files,
+            "zones": zones,
+            "pendingEvents": self.handler.scheduler.pending_count(),
+            "queuedJobs": self.db_manager.count_jobs(),
+            "lastSync": self.handler.last_sync_time,
+            "lastScan": self.handler.last_scan_time
+        }
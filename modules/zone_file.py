@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import hashlib
+
+# Remove a comment (starting with ';' outside of quotes) from a line of a zone file
+def strip_comment(line):
+    in_quotes = False
+    escaped = False
+
+    for index, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif char == ';' and not in_quotes:
+            return line[:index]
+
+    return line
+
+# Normalize a line of a zone file: no comment and single blanks between the fields; None for an empty line.
+# Quoted strings are kept as they are.
+def normalize_line(line):
+    line = strip_comment(line.rstrip('\r\n'))
+    if not line.strip():
+        return None
+
+    # Lines starting with a blank belong to the previous owner name; keep that information
+    prefix = ' ' if line[0] in ' \t' else ''
+
+    fields = []
+    field = ''
+    in_quotes = False
+    escaped = False
+    for char in line:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            in_quotes = not in_quotes
+
+        if char in ' \t' and not in_quotes:
+            if field:
+                fields.append(field)
+                field = ''
+        else:
+            field += char
+    if field:
+        fields.append(field)
+
+    return prefix + ' '.join(fields)
+
+# Normalize a zone file: no comments, no empty lines and single blanks between the fields
+def normalize_zone(content):
+    lines = [normalize_line(line) for line in content.splitlines()]
+    return '\n'.join(line for line in lines if line is not None)
+
+# Digest of the normalized zone file; it only changes if the content of the zone changes.
+# The file is hashed line by line, so a big zone is never in memory as a whole; the
+# digest is the same as the one of normalize_zone over the whole content.
+def zone_digest(file_path):
+    digest = hashlib.sha256()
+    separator = b''
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+            for line in file:
+                line = normalize_line(line)
+                if line is None:
+                    continue
+                digest.update(separator + line.encode('utf-8'))
+                separator = b'\n'
+    except OSError:
+        return None
+
+    return digest.hexdigest()
+
+# Raised if a zone file can't be parsed; the caller falls back to the full import
+class ZoneParseError(Exception):
+    pass
+
+# Record classes which can stand between the owner/TTL and the record type
+RECORD_CLASSES = ['IN', 'CH', 'HS', 'CS']
+
+# Split a line into fields; quoted strings stay one field including the quotes.
+# Parentheses are returned as fields of their own.
+def tokenize(line):
+    tokens = []
+    token = ''
+    in_quotes = False
+    escaped = False
+
+    for char in line:
+        if escaped:
+            token += char
+            escaped = False
+        elif char == '\\':
+            token += char
+            escaped = True
+        elif char == '"':
+            token += char
+            in_quotes = not in_quotes
+        elif in_quotes:
+            token += char
+        elif char in ' \t':
+            if token:
+                tokens.append(token)
+                token = ''
+        elif char in '()':
+            if token:
+                tokens.append(token)
+                token = ''
+            tokens.append(char)
+        else:
+            token += char
+
+    if in_quotes:
+        raise ZoneParseError(f"Unterminated quoted string in line: {line}")
+    if token:
+        tokens.append(token)
+
+    return tokens
+
+# Join the lines of a zone file to logical entries; a record in parentheses can span several lines.
+# The content is a string or an iterable of lines like an open file. Returns tuples (starts with blank, fields).
+def logical_lines(content):
+    entry = None
+    depth = 0
+
+    for line in (content.splitlines() if isinstance(content, str) else content):
+        line = strip_comment(line.rstrip('\r\n'))
+        tokens = tokenize(line)
+
+        if entry is None:
+            if not tokens:
+                continue
+            entry = (line[0] in ' \t', [])
+
+        for token in tokens:
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+                if depth < 0:
+                    raise ZoneParseError("Unbalanced parentheses")
+            else:
+                entry[1].append(token)
+
+        if depth == 0:
+            if entry[1]:
+                yield entry
+            entry = None
+
+    if depth != 0:
+        raise ZoneParseError("Unbalanced parentheses at the end of the file")
+
+# Convert a TTL like 3600, 1h or 1d12h into seconds
+def parse_ttl(value):
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+    if value.isdigit():
+        return int(value)
+
+    seconds = 0
+    number = ''
+    for char in value.lower():
+        if char.isdigit():
+            number += char
+        elif char in units and number:
+            seconds += int(number) * units[char]
+            number = ''
+        else:
+            raise ValueError(value)
+    if number:
+        raise ValueError(value)
+
+    return seconds
+
+def is_ttl(value):
+    try:
+        parse_ttl(value)
+        return True
+    except ValueError:
+        return False
+
+# Make a name absolute; relative names are relative to the current $ORIGIN
+def absolute_name(name, origin):
+    name = name.lower()
+
+    if name == '@':
+        return origin
+    if name.endswith('.'):
+        return name
+    return f"{name}.{origin}" if origin != '.' else f"{name}."
+
+# Name of a record relative to the zone like the Hetzner API uses it ('@' for the zone itself)
+def relative_name(name, zone_origin):
+    if name == zone_origin:
+        return '@'
+    if name.endswith('.' + zone_origin):
+        return name[:-len(zone_origin) - 1]
+
+    # A name outside of the zone; keep it absolute
+    return name
+
+# Position of the target name in the value of records pointing to another name
+TARGET_FIELDS = {'CNAME': 0, 'NS': 0, 'PTR': 0, 'DNAME': 0, 'MX': 1, 'SRV': 3}
+
+# The $TTL of a zone file given as string or None if it has none
+def zone_default_ttl(content):
+    for _, fields in logical_lines(content):
+        if fields[0].upper() == '$TTL' and len(fields) > 1 and is_ttl(fields[1]):
+            return parse_ttl(fields[1])
+    return None
+
+# Parse a BIND zone file into a normalized list of records [name, type, value, ttl].
+# The names are relative to the zone; $ORIGIN, $TTL and multi-line records are supported.
+# The content is a string or an open text file, which is read line by line.
+# Records without TTL, $TTL and previous record get zone_ttl, e.g. the TTL of the zone at Hetzner.
+def parse_zone(content, domain, zone_ttl=None):
+    zone_origin = domain.lower().rstrip('.') + '.'
+    origin = zone_origin
+    default_ttl = None
+    last_name = None
+    last_ttl = None
+    records = []
+
+    for starts_with_blank, fields in logical_lines(content):
+        if fields[0].upper() == '$ORIGIN':
+            if len(fields) < 2:
+                raise ZoneParseError("$ORIGIN without a name")
+            origin = fields[1].lower()
+            if not origin.endswith('.'):
+                origin = f"{origin}.{zone_origin}"
+            continue
+        if fields[0].upper() == '$TTL':
+            if len(fields) < 2 or not is_ttl(fields[1]):
+                raise ZoneParseError("$TTL without a valid value")
+            default_ttl = parse_ttl(fields[1])
+            continue
+        if fields[0].startswith('$'):
+            # $INCLUDE and $GENERATE can't be resolved here
+            raise ZoneParseError(f"Unsupported directive {fields[0]}")
+
+        # The owner name; a line starting with a blank uses the name of the previous record
+        if starts_with_blank:
+            if last_name is None:
+                raise ZoneParseError("Record without owner name")
+            name = last_name
+        else:
+            name = relative_name(absolute_name(fields.pop(0), origin), zone_origin)
+
+        # TTL and class are optional and may come in both orders
+        ttl = None
+        while fields and (fields[0].upper() in RECORD_CLASSES or is_ttl(fields[0])):
+            field = fields.pop(0)
+            if field.upper() not in RECORD_CLASSES:
+                ttl = parse_ttl(field)
+
+        if len(fields) < 2:
+            raise ZoneParseError(f"Incomplete record for {name}")
+
+        record_type = fields[0].upper()
+        values = fields[1:]
+
+        # Target names get the same form as the owner names: relative to the zone ('@' for the
+        # zone itself) and absolute outside of it. "mail", "mail.example.com." and "mail" after
+        # "$ORIGIN example.com." are the same name and must compare equal; Hetzner reads
+        # relative names relative to the zone.
+        target = TARGET_FIELDS.get(record_type)
+        if target is not None and target < len(values):
+            values[target] = relative_name(absolute_name(values[target], origin), zone_origin)
+
+        value = ' '.join(values)
+
+        if ttl is None:
+            # Without an own TTL the record uses the $TTL, the TTL of the previous record or the one of the zone
+            ttl = default_ttl if default_ttl is not None else last_ttl if last_ttl is not None else zone_ttl
+
+        records.append([name, record_type, value, ttl])
+        last_name = name
+        last_ttl = ttl
+
+    return records
+
+# Records which Hetzner manages itself and which may differ from the zone file: the SOA and the name servers of the zone
+def is_managed_record(name, record_type):
+    return record_type == 'SOA' or (record_type == 'NS' and name == '@')
+
+# Compare two record lists and return the records to create, to update (only the TTL changed)
+# and to delete. The records managed by Hetzner are never part of the difference.
+def diff_records(old_records, new_records):
+    old = {(name, record_type, value): ttl for name, record_type, value, ttl in old_records if not is_managed_record(name, record_type)}
+    new = {(name, record_type, value): ttl for name, record_type, value, ttl in new_records if not is_managed_record(name, record_type)}
+
+    additions = [[*key, new[key]] for key in new if key not in old]
+    deletions = [[*key, old[key]] for key in old if key not in new]
+    updates = [[*key, new[key]] for key in new if key in old and old[key] != new[key]]
+
+    return additions, updates, deletions
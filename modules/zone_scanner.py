@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+import os
+import stat
+from fnmatch import fnmatch
+from collections import namedtuple
+
+# Zone files of the Hetzner name servers themselves; they must never be uploaded
+EXCLUDED_FILES = ["hydrogen.ns.hetzner.com.db",
+                  "oxygen.ns.hetzner.com.db",
+                  "helium.ns.hetzner.com.db"]
+
+# One zone file with the data of a single stat call; mtime_ns has nanoseconds, so two changes
+# within the same second can't be mixed up
+ZoneEntry = namedtuple("ZoneEntry", ["name", "path", "mtime_ns", "size"])
+
+class ZoneScanner:
+    def __init__(self, directory, suffix=".db", excluded_files=None, include=None, exclude=None):
+        self.directory = os.path.abspath(directory)
+        self.suffix = suffix
+        self.excluded_files = set(excluded_files if excluded_files is not None else EXCLUDED_FILES)
+        # Optional shell patterns of the file names, e.g. a watch target only takes "customer-*.db"
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+
+    # Only the names are checked; no system call needed
+    def is_zone_file(self, file_name):
+        if not file_name.endswith(self.suffix) or file_name in self.excluded_files:
+            return False
+        if self.include and not any(fnmatch(file_name, pattern) for pattern in self.include):
+            return False
+        return not any(fnmatch(file_name, pattern) for pattern in self.exclude)
+
+    # All zone files of the directory; the file type comes from the directory entry
+    # and only the zone files are stat'ed, once. Symlinks to zone files are followed
+    # like os.path.isfile did; a dangling link counts as missing file.
+    def scan(self):
+        # An unreadable directory raises; an empty result would look like all zones were deleted
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not self.is_zone_file(entry.name):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    file_stat = entry.stat()
+                except OSError:
+                    # Deleted between reading the directory and the stat
+                    continue
+                yield ZoneEntry(entry.name, entry.path, file_stat.st_mtime_ns, file_stat.st_size)
+
+    # Device and inode of the directory; they change if the directory was replaced, e.g. restored or remounted
+    def identity(self):
+        try:
+            directory_stat = os.stat(self.directory)
+        except OSError:
+            return None
+        return f"{directory_stat.st_dev}:{directory_stat.st_ino}"
+
+    # A single zone file or None if it doesn't exist (anymore)
+    def stat_zone(self, file_name):
+        file_path = os.path.join(self.directory, file_name)
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        return ZoneEntry(file_name, file_path, file_stat.st_mtime_ns, file_stat.st_size)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Tests of the schema migration; it rewrites the database of every installation on its update
+#   python3 -m unittest discover tests
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+# Make the modules of the daemon available when started from the tests directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.db_manager import DBManager
+
+ROWS = [("a.example.db", 1697104800, 1697104900), ("b.example.db", 1697104801, 1697104901)]
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, "file_info.db")
+
+        # The schema of the first version: no target, zone id or digest
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute("CREATE TABLE file_info (filename TEXT PRIMARY KEY, last_modified INTEGER, last_checked INTEGER)")
+            conn.executemany("INSERT INTO file_info VALUES (?, ?, ?)", ROWS)
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        db_manager = DBManager(self.db_path)
+        db_manager.create_table()
+        self.addCleanup(db_manager.close)
+        return db_manager
+
+    def columns(self, db_manager, table):
+        return [row[1] for row in db_manager.conn.execute(f"PRAGMA table_info({table})")]
+
+    def test_rows_are_kept(self):
+        db_manager = self.open()
+
+        self.assertEqual(self.columns(db_manager, "file_info"), ["target", "filename", "last_modified", "last_checked", "zone_id", "digest"])
+        rows = db_manager.conn.execute("SELECT target, filename, last_modified, last_checked, zone_id, digest FROM file_info ORDER BY filename").fetchall()
+        self.assertEqual(rows, [("",) + row + (None, None) for row in ROWS])
+        self.assertFalse(db_manager.conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%_new'").fetchall())
+
+        # The old rows belong to the target "" of the old configuration
+        self.assertEqual(db_manager.get_all_file_info(), {name: (modified, checked) for name, modified, checked in ROWS})
+        self.assertEqual(db_manager.for_target("other").get_all_file_info(), {})
+
+    def test_targets_are_kept_apart(self):
+        db_manager = self.open()
+        other = db_manager.for_target("other")
+        self.assertTrue(other.insert_file_info("a.example.db", 1, 2, "zone1"))
+
+        self.assertEqual(other.get_zone_id("a.example.db"), "zone1")
+        self.assertIsNone(db_manager.get_zone_id("a.example.db"))
+        self.assertEqual(db_manager.get_file_info("a.example.db"), ROWS[0][1:])
+
+    # The second start finds the migrated tables and changes nothing
+    def test_migration_runs_once(self):
+        db_manager = self.open()
+        db_manager.set_zone_id("a.example.db", "zone1")
+        db_manager.close()
+
+        db_manager = self.open()
+        self.assertEqual(db_manager.get_zone_id("a.example.db"), "zone1")
+        self.assertEqual(len(db_manager.get_all_file_info()), 2)
+        for table in ["zone_snapshot", "sync_jobs", "scan_checkpoint"]:
+            self.assertEqual(self.columns(db_manager, table)[0], "target")
+
+if __name__ == "__main__":
+    unittest.main()
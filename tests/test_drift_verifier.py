@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Tests of the comparison of the drift verifier; a false drift uploads the zone again
+#   python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+# Make the modules of the daemon available when started from the tests directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.zone_file import parse_zone, zone_default_ttl
+from modules.drift_verifier import records_differ
+
+LOCAL = """$TTL 3600
+@       IN      A       192.0.2.1
+www     IN      CNAME   @
+@       IN      MX      10 mail
+mail    IN      A       192.0.2.2
+_sip._tcp IN    SRV     10 5 5060 sip
+ftp     IN      CNAME   files.example.org.
+"""
+
+# The same zone as Hetzner exports it: absolute targets and TTLs written out
+EXPORT = """$ORIGIN example.com.
+$TTL 86400
+@ IN SOA hydrogen.ns.hetzner.com. dns.hetzner.com. 2023101201 86400 10800 3600000 3600
+@ IN NS hydrogen.ns.hetzner.com.
+@ 3600 IN A 192.0.2.1
+www 3600 IN CNAME example.com.
+@ 3600 IN MX 10 mail.example.com.
+mail 3600 IN A 192.0.2.2
+_sip._tcp 3600 IN SRV 10 5 5060 sip.example.com.
+ftp 3600 IN CNAME FILES.example.org.
+"""
+
+class RecordsDifferTest(unittest.TestCase):
+    def parse(self, local, export):
+        zone_ttl = zone_default_ttl(export)
+        return parse_zone(local, "example.com", zone_ttl), parse_zone(export, "example.com", zone_ttl)
+
+    def test_same_zone(self):
+        self.assertFalse(records_differ(*self.parse(LOCAL, EXPORT)))
+
+    def test_target_names_are_canonical(self):
+        records = parse_zone("$TTL 60\n$ORIGIN sub.example.com.\nwww IN CNAME host\n@ IN MX 10 mail.example.com.\n"
+                             "other IN CNAME example.com.\n", "example.com")
+        self.assertEqual(records, [['www.sub', 'CNAME', 'host.sub', 60], ['sub', 'MX', '10 mail', 60], ['other.sub', 'CNAME', '@', 60]])
+
+    def test_changed_target(self):
+        local, remote = self.parse(LOCAL, EXPORT.replace("10 mail.example.com.", "10 mx.example.com."))
+        self.assertTrue(records_differ(local, remote))
+
+    # A record without a TTL gets the TTL of the zone at Hetzner, the same as a written out one
+    def test_effective_ttl(self):
+        local, remote = self.parse("www IN A 192.0.2.1\n", "$TTL 86400\nwww 86400 IN A 192.0.2.1\n")
+        self.assertEqual(local, [['www', 'A', '192.0.2.1', 86400]])
+        self.assertFalse(records_differ(local, remote))
+
+    def test_changed_ttl(self):
+        local, remote = self.parse("www IN A 192.0.2.1\n", "$TTL 86400\nwww 300 IN A 192.0.2.1\n")
+        self.assertTrue(records_differ(local, remote))
+
+    def test_record_ttl_before_zone_ttl(self):
+        records = parse_zone("www 300 IN A 192.0.2.1\nftp IN A 192.0.2.2\n$TTL 600\nmail IN A 192.0.2.3\n", "example.com", 86400)
+        self.assertEqual([record[3] for record in records], [300, 300, 600])
+        self.assertEqual(parse_zone("www IN A 192.0.2.1\n", "example.com", 86400)[0][3], 86400)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Tests of the dry run of "migrate"; it runs next to the daemon and must never change its database
+#   python3 -m unittest discover tests
+
+import io
+import os
+import sys
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import unittest
+
+# Make the modules of the daemon available when started from the tests directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.db_manager import DBManager
+from modules.hetzner_dns import HetznerDNS
+from modules.migration import Migration
+from modules.observer_handler import ObserverHandler
+
+# The API is never asked; the zones of new files count as to create
+class OfflineDNS(HetznerDNS):
+    def get_all_zones(self):
+        return {}
+
+def file_digest(path):
+    with open(path, "rb") as db_file:
+        return hashlib.sha256(db_file.read()).hexdigest()
+
+class DryRunTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.zone_directory = os.path.join(self.directory, "zones")
+        os.mkdir(self.zone_directory)
+        for domain in ["old.example", "new.example"]:
+            with open(os.path.join(self.zone_directory, domain + ".db"), "w") as zone_file:
+                zone_file.write("$TTL 60\n@ IN A 192.0.2.1\n")
+        self.db_path = os.path.join(self.directory, "file_info.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def dry_run(self):
+        db_manager = DBManager(self.db_path, read_only=True)
+        handler = ObserverHandler(db_manager, OfflineDNS("token"), self.zone_directory)
+        output = io.StringIO()
+        try:
+            plan = Migration(handler, output).print_plan()
+        finally:
+            handler.hetzner_dns.close()
+            db_manager.close()
+        return plan, output.getvalue()
+
+    # The schema of the versions before the targets: no target, zone id or digest
+    def test_database_of_an_older_version(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE file_info (filename TEXT PRIMARY KEY, last_modified INTEGER, last_checked INTEGER)")
+            conn.executemany("INSERT INTO file_info VALUES (?, ?, ?)", [("old.example.db", 1697104800, 1697104800),
+                                                                        ("gone.example.db", 1697104800, 1697104800)])
+        conn.close()
+        digest = file_digest(self.db_path)
+
+        plan, output = self.dry_run()
+        # The older versions saved the mtime in seconds, so the known file counts as modified
+        self.assertEqual(plan.new, ["new.example.db"])
+        self.assertEqual(plan.modified, ["old.example.db"])
+        self.assertEqual(plan.deleted, ["gone.example.db"])
+        self.assertIn("1 new zone files", output)
+        self.assertEqual(file_digest(self.db_path), digest)
+
+    def test_missing_database(self):
+        plan, _ = self.dry_run()
+        self.assertEqual(sorted(plan.new), ["new.example.db", "old.example.db"])
+        self.assertFalse(os.path.exists(self.db_path))
+
+if __name__ == "__main__":
+    unittest.main()
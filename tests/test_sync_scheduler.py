@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Tests of the scheduler which decides when and in which order the zones are synchronized
+#   python3 -m unittest discover tests
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+# Make the modules of the daemon available when started from the tests directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.sync_scheduler import SyncScheduler, PRIORITY_URGENT, PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+# Records the syncs and how many of them ran at the same time per zone
+class SyncRecorder:
+    def __init__(self, duration=0.0):
+        self.duration = duration
+        self.calls = []
+        self.running = {}
+        self.max_running = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, file_name, waited, event_time, mtime):
+        with self.lock:
+            self.calls.append(file_name)
+            self.running[file_name] = self.running.get(file_name, 0) + 1
+            self.max_running[file_name] = max(self.max_running.get(file_name, 0), self.running[file_name])
+        time.sleep(self.duration)
+        with self.lock:
+            self.running[file_name] -= 1
+
+class SchedulerTest(unittest.TestCase):
+    def start(self, recorder, **kwargs):
+        scheduler = SyncScheduler(recorder, **kwargs)
+        scheduler.start()
+        self.addCleanup(scheduler.join)
+        self.addCleanup(scheduler.stop)
+        return scheduler
+
+    def test_burst_is_one_sync(self):
+        recorder = SyncRecorder()
+        scheduler = self.start(recorder, quiet_window=0.2, max_delay=5)
+        for _ in range(10):
+            scheduler.schedule("a.db")
+            time.sleep(0.01)
+        self.assertEqual(scheduler.wait_for(["a.db"], 5), 0)
+        self.assertEqual(recorder.calls, ["a.db"])
+
+    def test_max_delay_ends_a_long_burst(self):
+        recorder = SyncRecorder()
+        scheduler = self.start(recorder, quiet_window=0.2, max_delay=0.3)
+        deadline = time.monotonic() + 0.6
+        while time.monotonic() < deadline:
+            scheduler.schedule("a.db")
+            time.sleep(0.05)
+        self.assertIn("a.db", recorder.calls)
+
+    # An event during the sync of a zone leads to a second sync after the first one
+    def test_no_concurrent_syncs_of_one_zone(self):
+        recorder = SyncRecorder(duration=0.2)
+        scheduler = self.start(recorder, quiet_window=0, workers=4)
+        scheduler.schedule("a.db", immediate=True)
+        time.sleep(0.05)
+        for _ in range(3):
+            scheduler.schedule("a.db", immediate=True)
+        self.assertEqual(scheduler.wait_for(["a.db"], 5), 0)
+        self.assertEqual(recorder.calls, ["a.db", "a.db"])
+        self.assertEqual(recorder.max_running["a.db"], 1)
+
+    def test_urgent_jumps_the_queue(self):
+        scheduler = SyncScheduler(SyncRecorder())
+        for index in range(5):
+            scheduler.schedule(f"bulk{index}.db", immediate=True, priority=PRIORITY_BULK)
+        scheduler.schedule("edit.db", immediate=True, priority=PRIORITY_INTERACTIVE)
+        scheduler.schedule("new.db", immediate=True, priority=PRIORITY_URGENT)
+
+        due, _ = scheduler.pop_due(time.monotonic(), 2)
+        self.assertEqual([entry[0] for entry in due], ["new.db", "edit.db"])
+
+    # A zone keeps the highest priority of its events, also when it is already due
+    def test_priority_is_raised(self):
+        scheduler = SyncScheduler(SyncRecorder())
+        scheduler.schedule("a.db", immediate=True, priority=PRIORITY_BULK)
+        scheduler.schedule("b.db", immediate=True, priority=PRIORITY_BULK)
+        scheduler.pop_due(time.monotonic(), 0)
+        scheduler.schedule("b.db", priority=PRIORITY_URGENT)
+
+        due, _ = scheduler.pop_due(time.monotonic())
+        self.assertEqual([entry[0] for entry in due], ["b.db", "a.db"])
+
+    # Every fair_share-th sync comes from the bulk queue during a stream of edits
+    def test_fair_share_of_bulk_work(self):
+        scheduler = SyncScheduler(SyncRecorder(), fair_share=4)
+        for index in range(9):
+            scheduler.schedule(f"edit{index}.db", immediate=True, priority=PRIORITY_INTERACTIVE)
+        for index in range(3):
+            scheduler.schedule(f"bulk{index}.db", immediate=True, priority=PRIORITY_BULK)
+
+        due, _ = scheduler.pop_due(time.monotonic())
+        order = [entry[0] for entry in due]
+        self.assertEqual(order[3], "bulk0.db")
+        self.assertEqual(order[7], "bulk1.db")
+        # The rest of the bulk work follows once the edits are done
+        self.assertEqual(order[-2:], ["edit8.db", "bulk2.db"])
+        self.assertEqual(len(order), 12)
+
+    def test_wait_for_timeout(self):
+        release = threading.Event()
+        scheduler = self.start(lambda *args: release.wait(5), quiet_window=0)
+        scheduler.schedule("a.db", immediate=True)
+        scheduler.schedule("b.db", immediate=True)
+
+        start_time = time.monotonic()
+        self.assertEqual(scheduler.wait_for(["a.db", "b.db", "other.db"], 0.2), 2)
+        self.assertLess(time.monotonic() - start_time, 2)
+
+        release.set()
+        self.assertEqual(scheduler.wait_for(["a.db", "b.db"], 5), 0)
+
+    def test_wait_idle(self):
+        recorder = SyncRecorder(duration=0.1)
+        scheduler = self.start(recorder, quiet_window=0.1)
+        scheduler.schedule("a.db")
+        scheduler.schedule("b.db", immediate=True)
+        scheduler.wait_idle()
+        self.assertEqual(sorted(recorder.calls), ["a.db", "b.db"])
+        self.assertEqual(scheduler.pending_count(), 0)
+
+    # A stopped scheduler doesn't keep the waiting threads blocked
+    def test_wait_returns_when_stopped(self):
+        scheduler = self.start(SyncRecorder(), quiet_window=60, max_delay=60)
+        scheduler.schedule("a.db")
+        threading.Timer(0.2, scheduler.stop).start()
+
+        start_time = time.monotonic()
+        scheduler.wait_idle()
+        self.assertEqual(scheduler.wait_for(["a.db"]), 1)
+        self.assertLess(time.monotonic() - start_time, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Tests of the zone file parser and the record diff; the diff decides which records are
+# deleted at Hetzner, so both must be exact.
+#   python3 -m unittest discover tests
+
+import os
+import sys
+import hashlib
+import tempfile
+import unittest
+
+# Make the modules of the daemon available when started from the tests directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.zone_file import parse_zone, diff_records, normalize_zone, parse_ttl, zone_digest, ZoneParseError
+
+ZONE = """$TTL 14400
+@       86400   IN      SOA     ns1.example.net. hostmaster.example.net. (
+                                2023101201  ; serial
+                                3600        ; refresh
+                                7200        ; retry
+                                1209600     ; expire
+                                86400 )     ; minimum
+@       86400   IN      NS      ns1.example.net.
+@       86400   IN      NS      ns2.example.net.
+@               IN      A       192.0.2.1
+www     IN      300     CNAME   @
+        3600    IN      TXT     "v=spf1 a mx ~all; not a comment"
+mail    14400   IN      A       192.0.2.2
+"""
+
+class ParseZoneTest(unittest.TestCase):
+    def test_records(self):
+        records = parse_zone(ZONE, "example.com")
+        self.assertEqual(records[0][:2], ['@', 'SOA'])
+        self.assertEqual(records[0][2].split()[2], '2023101201')
+        self.assertIn(['@', 'NS', 'ns1.example.net.', 86400], records)
+        # The record without TTL uses $TTL
+        self.assertIn(['@', 'A', '192.0.2.1', 14400], records)
+        # Class and TTL in the other order
+        self.assertIn(['www', 'CNAME', '@', 300], records)
+        # A line starting with a blank belongs to the previous owner; the ';' in quotes is no comment
+        self.assertIn(['www', 'TXT', '"v=spf1 a mx ~all; not a comment"', 3600], records)
+        self.assertIn(['mail', 'A', '192.0.2.2', 14400], records)
+        self.assertEqual(len(records), 7)
+
+    def test_names_are_relative_to_the_zone(self):
+        records = parse_zone("$TTL 60\nwww.example.com. IN A 192.0.2.1\nexample.com. IN A 192.0.2.2\n"
+                             "other.org. IN A 192.0.2.3\n", "example.com")
+        self.assertEqual([record[0] for record in records], ['www', '@', 'other.org.'])
+
+    def test_origin(self):
+        records = parse_zone("$TTL 60\n$ORIGIN sub\nwww IN A 192.0.2.1\n", "example.com")
+        self.assertEqual(records, [['www.sub', 'A', '192.0.2.1', 60]])
+
+    def test_ttl_units(self):
+        self.assertEqual(parse_ttl("1d12h"), 129600)
+        self.assertEqual(parse_ttl("3600"), 3600)
+        with self.assertRaises(ValueError):
+            parse_ttl("12x")
+
+    def test_errors(self):
+        for content in ["$INCLUDE other.db\n", "@ IN SOA ns1. host. ( 1 2 3\n", 'www IN TXT "open\n', "   IN A 192.0.2.1\n"]:
+            with self.assertRaises(ZoneParseError):
+                parse_zone(content, "example.com")
+
+    def test_normalize_ignores_comments_and_blanks(self):
+        self.assertEqual(normalize_zone("www  IN A 192.0.2.1 ; old\n\n"), normalize_zone("www IN\tA 192.0.2.1"))
+        self.assertNotEqual(normalize_zone('@ IN TXT "a  b"'), normalize_zone('@ IN TXT "a b"'))
+
+class ZoneFileTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.file_path = tempfile.mkstemp(suffix=".db")
+        with os.fdopen(handle, "w", newline="") as zone_file:
+            zone_file.write(ZONE.replace("\n", "\r\n"))
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    # The file is read line by line; the result must be the same as for the whole content
+    def test_parse_from_file(self):
+        with open(self.file_path, "r", encoding="utf-8") as zone_file:
+            self.assertEqual(parse_zone(zone_file, "example.com"), parse_zone(ZONE, "example.com"))
+
+    def test_digest_of_normalized_content(self):
+        self.assertEqual(zone_digest(self.file_path), hashlib.sha256(normalize_zone(ZONE).encode("utf-8")).hexdigest())
+
+class DiffRecordsTest(unittest.TestCase):
+    def test_diff(self):
+        old = [['@', 'A', '192.0.2.1', 300], ['www', 'A', '192.0.2.1', 300], ['mail', 'A', '192.0.2.2', 300]]
+        new = [['@', 'A', '192.0.2.1', 300], ['www', 'A', '192.0.2.1', 600], ['ftp', 'A', '192.0.2.3', 300]]
+        additions, updates, deletions = diff_records(old, new)
+        self.assertEqual(additions, [['ftp', 'A', '192.0.2.3', 300]])
+        self.assertEqual(updates, [['www', 'A', '192.0.2.1', 600]])
+        self.assertEqual(deletions, [['mail', 'A', '192.0.2.2', 300]])
+
+    def test_unchanged(self):
+        records = parse_zone(ZONE, "example.com")
+        self.assertEqual(diff_records(records, parse_zone(ZONE, "example.com")), ([], [], []))
+
+    def test_managed_records_are_left_out(self):
+        old = [['@', 'SOA', 'ns1. host. 1 2 3 4 5', 300], ['@', 'NS', 'ns1.example.net.', 300], ['sub', 'NS', 'ns1.example.net.', 300]]
+        new = [['@', 'SOA', 'ns1. host. 2 2 3 4 5', 300], ['@', 'NS', 'ns2.example.net.', 300], ['sub', 'NS', 'ns2.example.net.', 300]]
+        additions, updates, deletions = diff_records(old, new)
+        # Only the delegation of the sub zone; SOA and the name servers of the zone belong to Hetzner
+        self.assertEqual(additions, [['sub', 'NS', 'ns2.example.net.', 300]])
+        self.assertEqual(updates, [])
+        self.assertEqual(deletions, [['sub', 'NS', 'ns1.example.net.', 300]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# End-to-end benchmark of the daemon against the local mock API.
+# Generates N zone files in a temporary directory and measures
+#   - the initial full sync (syncs/sec and API calls per zone)
+#   - single edits through the file system watcher (API calls per change and edit-to-push latency)
+#
+#   python3 tools/benchmark.py --zones 100 1000 10000 --edits 50 --latency 0.02
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import statistics
+
+# Make the modules of the daemon available when started from the tools directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from watchdog.observers import Observer
+from modules.db_manager import DBManager
+from modules.hetzner_dns import HetznerDNS
+from modules.observer_handler import ObserverHandler
+from modules.rate_limiter import RateLimiter
+from modules.tracing import Tracer, percentile
+from mock_hetzner_api import MockHetznerAPI
+
+ZONE_TEMPLATE = """$TTL 14400
+@       86400   IN      SOA     ns1.example.net. hostmaster.example.net. (
+                                {serial}  ; serial
+                                3600        ; refresh
+                                7200        ; retry
+                                1209600     ; expire
+                                86400 )     ; minimum
+@       86400   IN      NS      ns1.example.net.
+@       86400   IN      NS      ns2.example.net.
+@       14400   IN      A       192.0.2.{host}
+www     14400   IN      CNAME   @
+mail    14400   IN      A       192.0.2.{host}
+@       14400   IN      MX      10 mail
+@       14400   IN      TXT     "v=spf1 a mx ip4:192.0.2.{host} ~all"
+"""
+
+def write_zone(directory, index, serial=2023101201, host=None):
+    file_path = os.path.join(directory, f"zone{index}.example.db")
+    with open(file_path, "w") as zone_file:
+        zone_file.write(ZONE_TEMPLATE.format(serial=serial, host=host if host is not None else index % 250 + 1))
+    return file_path
+
+def run_benchmark(zone_count, edits, workers, debounce, mock_api, trace_log=""):
+    directory = tempfile.mkdtemp(prefix="hetznerdns-bench-")
+    try:
+        for index in range(zone_count):
+            write_zone(directory, index)
+
+        db_manager = DBManager(os.path.join(directory, "bench.sqlite"))
+        db_manager.create_table()
+        hetzner_dns = HetznerDNS("benchmark", pool_size=workers, max_retries=3, backoff_factor=0.05,
+                                 rate_limiter=RateLimiter(10000, 10000), api_url=mock_api.url)
+        tracer = Tracer(trace_log)
+        handler = ObserverHandler(db_manager, hetzner_dns, directory, debounce_seconds=debounce, workers=workers, tracer=tracer)
+        handler.scheduler.start()
+
+        # Initial full sync of all zones
+        mock_api.reset_stats()
+        start_time = time.monotonic()
+        handler.check_4_changes()
+        full_sync_time = time.monotonic() - start_time
+        full_sync_calls = mock_api.total_calls()
+
+        # Single edits through the file system watcher
+        observer = Observer()
+        observer.schedule(handler, path=directory, recursive=False)
+        observer.start()
+        time.sleep(0.5)
+
+        mock_api.reset_stats()
+        latencies = []
+        for edit in range(edits):
+            index = edit * max(1, zone_count // max(1, edits)) % zone_count
+            zone_name = f"zone{index}.example"
+            pushed_before = mock_api.last_push.get(zone_name)
+
+            edit_time = time.time()
+            write_zone(directory, index, serial=2023101202 + edit, host=(index + edit + 7) % 250 + 1)
+
+            # Wait until the mock API got the change
+            deadline = time.monotonic() + debounce + 30
+            while time.monotonic() < deadline:
+                pushed = mock_api.last_push.get(zone_name)
+                if pushed is not None and pushed != pushed_before and pushed >= edit_time:
+                    latencies.append(pushed - edit_time)
+                    break
+                time.sleep(0.005)
+        edit_calls = mock_api.total_calls()
+
+        observer.stop()
+        observer.join()
+        handler.scheduler.stop()
+        handler.scheduler.join()
+        hetzner_dns.close()
+        db_manager.close()
+        tracer.close()
+
+        return {
+            "zones": zone_count,
+            "full_sync_seconds": full_sync_time,
+            "syncs_per_second": zone_count / full_sync_time if full_sync_time else 0.0,
+            "calls_per_zone": full_sync_calls / zone_count,
+            "edits": len(latencies),
+            "calls_per_change": edit_calls / len(latencies) if latencies else 0.0,
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_mean": statistics.mean(latencies) if latencies else 0.0
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against the local mock Hetzner DNS API")
+    parser.add_argument("--zones", type=int, nargs="+", default=[100, 1000, 10000], help="numbers of zone files")
+    parser.add_argument("--edits", type=int, default=20, help="single edits measured per run")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--debounce", type=float, default=0.5, help="quiet window of the scheduler in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency of the mock API in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing mock API requests")
+    parser.add_argument("--rate-limit", type=int, default=0, help="mock API requests per minute, 0 for unlimited")
+    parser.add_argument("--trace-log", default="", help="write the spans of the syncs to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    mock_api = MockHetznerAPI(latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit)
+    mock_api.start()
+
+    print(f"{'zones':>7} {'full sync s':>12} {'syncs/s':>9} {'calls/zone':>11} {'edits':>6} {'calls/change':>13} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        for zone_count in args.zones:
+            result = run_benchmark(zone_count, args.edits, args.workers, args.debounce, mock_api, args.trace_log)
+            print(f"{result['zones']:>7} {result['full_sync_seconds']:>12.2f} {result['syncs_per_second']:>9.1f} "
+                  f"{result['calls_per_zone']:>11.2f} {result['edits']:>6} {result['calls_per_change']:>13.2f} "
+                  f"{result['latency_p50'] * 1000:>8.0f} {result['latency_p95'] * 1000:>8.0f}")
+    finally:
+        mock_api.stop()
@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Local stand-in for the Hetzner DNS API with the endpoints used by modules/hetzner_dns.py.
+# Latency, error rate and rate limiting can be configured, so the daemon can be measured
+# without touching the real API:
+#   python3 tools/mock_hetzner_api.py --port 8080 --latency 0.05 --error-rate 0.01 --rate-limit 10
+# and set "apiUrl": "http://127.0.0.1:8080/api/v1" in config.json.
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Make the modules of the daemon available when started from the tools directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.hetzner_dns import endpoint_name
+from modules.zone_file import parse_zone, ZoneParseError
+
+API_PREFIX = "/api/v1"
+
+class MockHetznerAPI:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, rate_limit=0, rate_window=60):
+        # Seconds every request is delayed
+        self.latency = latency
+        # Share of requests answered with 500
+        self.error_rate = error_rate
+        # Allowed requests per rate window; 0 means unlimited
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+
+        self.lock = threading.Lock()
+        # zone id => {"id", "name", "ttl"}
+        self.zones = {}
+        # record id => {"id", "zone_id", "type", "name", "value", "ttl"}
+        self.records = {}
+        # Number of requests per endpoint ("GET /zones") and per status code
+        self.calls = Counter()
+        self.status_codes = Counter()
+        # zone name => time of the last change through an import or the record endpoints
+        self.last_push = {}
+        # (zone name, time) of every change in order; the replay tool measures its latencies with it
+        self.pushes = []
+        # Start and request count of the current rate window
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+
+        mock = self
+
+        class Handler(MockRequestHandler):
+            api = mock
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MockHetznerAPI", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.status_codes.clear()
+            del self.pushes[:]
+
+    # Returns the headers of the rate limit and whether the request is allowed
+    def check_rate_limit(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.rate_window:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+
+            if not self.rate_limit:
+                return {}, True
+
+            reset = max(0, int(self.rate_window - (now - self.window_start)))
+            remaining = max(0, self.rate_limit - self.window_requests)
+            headers = {
+                "RateLimit-Limit": str(self.rate_limit),
+                "RateLimit-Remaining": str(remaining),
+                "RateLimit-Reset": str(reset)
+            }
+            if self.window_requests > self.rate_limit:
+                headers["Retry-After"] = str(max(1, reset))
+                return headers, False
+            return headers, True
+
+    def find_zone(self, name):
+        for zone in self.zones.values():
+            if zone["name"] == name:
+                return zone
+        return None
+
+    def replace_records(self, zone_id, records):
+        for record_id in [record_id for record_id, record in self.records.items() if record["zone_id"] == zone_id]:
+            del self.records[record_id]
+        for name, record_type, value, ttl in records:
+            self.add_record({"zone_id": zone_id, "type": record_type, "name": name, "value": value, "ttl": ttl})
+
+    def add_record(self, data):
+        record = dict(data)
+        record["id"] = uuid.uuid4().hex
+        self.records[record["id"]] = record
+        return record
+
+    def touch(self, zone_id):
+        zone = self.zones.get(zone_id)
+        if zone:
+            self.last_push[zone["name"]] = time.time()
+            self.pushes.append((zone["name"], self.last_push[zone["name"]]))
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send header and body with one write; separate small writes run into the delayed ACK of the client
+    wbufsize = -1
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None, headers=None, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            data = json.dumps(body).encode("utf-8")
+        else:
+            data = (body or "").encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+        with self.api.lock:
+            self.api.status_codes[status] += 1
+
+    def read_body(self):
+        if "chunked" in (self.headers.get("Transfer-Encoding") or "").lower():
+            body = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # Skip the trailers up to the empty line
+                    while self.rfile.readline() not in [b"\r\n", b"\n", b""]:
+                        pass
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+
+        if (self.headers.get("Content-Encoding") or "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else url.path
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.read_body()
+
+        # Name of the endpoint for the statistics, ids replaced by placeholders; the same as in the metrics of the daemon
+        with self.api.lock:
+            self.api.calls[f"{method} {endpoint_name(path)}"] += 1
+
+        if self.api.latency:
+            time.sleep(self.api.latency)
+
+        rate_headers, allowed = self.api.check_rate_limit()
+        if not allowed:
+            return self.reply(429, {"message": "rate limit exceeded"}, rate_headers)
+
+        if self.api.error_rate and random.random() < self.api.error_rate:
+            return self.reply(500, {"message": "random error"}, rate_headers)
+
+        if self.headers.get("Auth-API-Token") is None:
+            return self.reply(401, {"message": "missing token"}, rate_headers)
+
+        parts = path.strip("/").split("/")
+        with self.api.lock:
+            status, result = self.route(method, parts, query, body)
+
+        if isinstance(result, str):
+            return self.reply(status, result, rate_headers, content_type="text/plain")
+        return self.reply(status, result, rate_headers)
+
+    def route(self, method, parts, query, body):
+        api = self.api
+
+        if parts == ["zones"] and method == "GET":
+            zones = sorted(api.zones.values(), key=lambda zone: zone["name"])
+            if "search_name" in query:
+                zones = [zone for zone in zones if query["search_name"] in zone["name"]]
+            return 200, self.paginate("zones", zones, query)
+
+        if parts == ["zones"] and method == "POST":
+            data = json.loads(body or b"{}")
+            if api.find_zone(data.get("name")):
+                return 422, {"message": "zone already exists"}
+            zone = {"id": uuid.uuid4().hex, "name": data.get("name"), "ttl": data.get("ttl")}
+            api.zones[zone["id"]] = zone
+            return 201, {"zone": zone}
+
+        if len(parts) == 2 and parts[0] == "zones" and method == "DELETE":
+            if parts[1] not in api.zones:
+                return 404, {"message": "zone not found"}
+            api.replace_records(parts[1], [])
+            api.touch(parts[1])
+            del api.zones[parts[1]]
+            return 200, {}
+
+        if len(parts) == 3 and parts[0] == "zones" and parts[2] == "import" and method == "POST":
+            zone = api.zones.get(parts[1])
+            if zone is None:
+                return 404, {"message": "zone not found"}
+            try:
+                records = parse_zone(body.decode("utf-8"), zone["name"])
+            except (UnicodeDecodeError, ZoneParseError) as e:
+                return 422, {"message": str(e)}
+            api.replace_records(zone["id"], records)
+            api.touch(zone["id"])
+            return 201, {"zone": zone}
+
+        if len(parts) == 3 and parts[0] == "zones" and parts[2] == "export" and method == "GET":
+            zone = api.zones.get(parts[1])
+            if zone is None:
+                return 404, {"message": "zone not found"}
+            lines = [f"$ORIGIN {zone['name']}."]
+            for record in api.records.values():
+                if record["zone_id"] == zone["id"]:
+                    ttl = record["ttl"] if record.get("ttl") is not None else ""
+                    lines.append(f"{record['name']} {ttl} IN {record['type']} {record['value']}")
+            return 200, "\n".join(lines) + "\n"
+
+        if parts == ["records"] and method == "GET":
+            if query.get("zone_id") not in api.zones:
+                return 404, {"message": "zone not found"}
+            records = [record for record in api.records.values() if record["zone_id"] == query["zone_id"]]
+            return 200, self.paginate("records", records, query)
+
+        if parts == ["records", "bulk"] and method in ["POST", "PUT"]:
+            data = json.loads(body or b"{}")
+            valid = []
+            invalid = []
+            for record in data.get("records") or []:
+                if record.get("zone_id") not in api.zones:
+                    invalid.append(record)
+                elif method == "POST":
+                    valid.append(api.add_record(record))
+                    api.touch(record["zone_id"])
+                elif record.get("id") in api.records:
+                    api.records[record["id"]].update(record)
+                    valid.append(api.records[record["id"]])
+                    api.touch(record["zone_id"])
+                else:
+                    invalid.append(record)
+            return 200, {"records": valid, "valid_records": valid, "invalid_records": invalid}
+
+        if len(parts) == 2 and parts[0] == "records" and method == "DELETE":
+            record = api.records.pop(parts[1], None)
+            if record is None:
+                return 404, {"message": "record not found"}
+            api.touch(record["zone_id"])
+            return 200, {}
+
+        return 404, {"message": "unknown endpoint"}
+
+    def paginate(self, key, items, query):
+        per_page = max(1, int(query.get("per_page", 100)))
+        page = max(1, int(query.get("page", 1)))
+        last_page = max(1, (len(items) + per_page - 1) // per_page)
+        return {
+            key: items[(page - 1) * per_page:page * per_page],
+            "meta": {"pagination": {"page": page, "per_page": per_page,
+                                    "last_page": last_page, "total_entries": len(items)}}
+        }
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Hetzner DNS API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every request is delayed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per window, 0 for unlimited")
+    parser.add_argument("--rate-window", type=int, default=60, help="length of the rate window in seconds")
+    args = parser.parse_args()
+
+    mock_api = MockHetznerAPI(args.host, args.port, args.latency, args.error_rate, args.rate_limit, args.rate_window)
+    print(f"Mock Hetzner DNS API listening on {mock_api.url}")
+    try:
+        mock_api.server.serve_forever()
+    except KeyboardInterrupt:
+        mock_api.stop()
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Replays an event trace of the daemon ("eventTrace" in config.json) against a temporary
+# directory and the local mock API. Every event is applied to the directory (a create or
+# modify writes a new version of the zone, a delete removes it, a move renames it) and then
+# handed to the observer handler exactly as recorded, in real time or accelerated.
+# Reports the API calls, the database writes and the edit-to-push latency, so changes of the
+# scheduler can be compared against the event storms of a real server:
+#
+#   python3 tools/replay_events.py events.log --speed 10 --debounce 2 --workers 4
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from collections import namedtuple
+
+# Make the modules of the daemon available when started from the tools directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from watchdog import events as watchdog_events
+from modules.db_manager import DBManager
+from modules.hetzner_dns import HetznerDNS
+from modules.inotify_watcher import InotifyWatcher, IN_CLOSE_WRITE, IN_MOVED_TO, IN_MOVED_FROM, IN_DELETE
+from modules.observer_handler import ObserverHandler
+from modules.rate_limiter import RateLimiter
+from modules.tracing import percentile
+from benchmark import ZONE_TEMPLATE
+from mock_hetzner_api import MockHetznerAPI
+
+# One line of the trace; the paths are reduced to the file names
+TraceEvent = namedtuple("TraceEvent", ["time", "event_type", "is_directory", "src_name", "dest_name"])
+
+# Event classes of watchdog per event type (file, directory); older versions don't know all of them
+WATCHDOG_EVENTS = {
+    "created": ("FileCreatedEvent", "DirCreatedEvent"),
+    "modified": ("FileModifiedEvent", "DirModifiedEvent"),
+    "deleted": ("FileDeletedEvent", "DirDeletedEvent"),
+    "moved": ("FileMovedEvent", "DirMovedEvent"),
+    "opened": ("FileOpenedEvent", None),
+    "closed": ("FileClosedEvent", None),
+    "closed_no_write": ("FileClosedNoWriteEvent", None)
+}
+
+# Events of the inotify backend and their flags
+INOTIFY_EVENTS = {
+    "in_close_write": IN_CLOSE_WRITE,
+    "in_moved_to": IN_MOVED_TO,
+    "in_moved_from": IN_MOVED_FROM,
+    "in_delete": IN_DELETE
+}
+
+# Events after which the file has new content or is gone
+WRITE_EVENTS = ["created", "modified", "in_close_write", "in_moved_to"]
+REMOVE_EVENTS = ["deleted", "in_delete", "in_moved_from"]
+
+# Read the trace; only the events of the given directory if there is one
+def read_trace(trace_path, directory=None):
+    trace = []
+    with open(trace_path) as trace_file:
+        for line_number, line in enumerate(trace_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+                event_time, event_type, is_directory, src_path = event[:4]
+            except (ValueError, TypeError):
+                print(f"Skipping invalid line {line_number}", file=sys.stderr)
+                continue
+            dest_path = event[4] if len(event) > 4 else ""
+
+            if directory and os.path.dirname(src_path.rstrip("/")) != directory.rstrip("/") and src_path.rstrip("/") != directory.rstrip("/"):
+                continue
+            trace.append(TraceEvent(float(event_time), event_type, bool(is_directory),
+                                    os.path.basename(src_path.rstrip("/")), os.path.basename(dest_path)))
+
+    trace.sort(key=lambda event: event.time)
+    return trace
+
+# Files which must exist before the trace starts: the first event of the file doesn't create it.
+# inotify only reports finished writes; a first write is taken as the edit of an existing zone.
+def existing_files(trace):
+    files = {}
+    for event in trace:
+        if event.is_directory:
+            continue
+        files.setdefault(event.src_name, event.event_type not in ["created", "in_moved_to"])
+        if event.dest_name:
+            files.setdefault(event.dest_name, False)
+    return sorted(name for name, exists in files.items() if exists)
+
+class Replay:
+    def __init__(self, directory, handler):
+        self.directory = directory
+        self.handler = handler
+        # The inotify events go through the same filter as in the daemon; the watcher isn't started
+        self.inotify = InotifyWatcher(handler, directory)
+        # Version of every file; each write changes the serial and an address
+        self.versions = {}
+        # Domain => times of its edits
+        self.edits = {}
+
+    def write_file(self, file_name):
+        version = self.versions.get(file_name, 0) + 1
+        self.versions[file_name] = version
+        with open(os.path.join(self.directory, file_name), "w") as zone_file:
+            zone_file.write(ZONE_TEMPLATE.format(serial=2023101200 + version, host=version % 250 + 1))
+
+    def remove_file(self, file_name):
+        try:
+            os.remove(os.path.join(self.directory, file_name))
+        except FileNotFoundError:
+            pass
+
+    # Change the directory like the recorded event did
+    def apply(self, event):
+        if event.is_directory:
+            return
+        if event.event_type in WRITE_EVENTS:
+            self.write_file(event.src_name)
+        elif event.event_type in REMOVE_EVENTS:
+            self.remove_file(event.src_name)
+        elif event.event_type == "moved":
+            try:
+                os.replace(os.path.join(self.directory, event.src_name), os.path.join(self.directory, event.dest_name))
+            except FileNotFoundError:
+                self.write_file(event.dest_name)
+
+    # Remember the time of the edit of every zone the event touches
+    def note_edit(self, event, edit_time):
+        if event.is_directory or event.event_type not in WRITE_EVENTS + REMOVE_EVENTS + ["moved"]:
+            return
+        for file_name in [event.src_name, event.dest_name]:
+            if file_name and self.handler.is_relevant_file(file_name):
+                domain = self.handler.hetzner_dns.get_domain(file_name)
+                self.edits.setdefault(domain, []).append(edit_time)
+
+    # Hand the event to the handler like the watcher would
+    def feed(self, event):
+        if event.event_type in INOTIFY_EVENTS:
+            self.inotify.handle_event(INOTIFY_EVENTS[event.event_type], event.src_name)
+            return
+
+        class_names = WATCHDOG_EVENTS.get(event.event_type)
+        class_name = class_names[1 if event.is_directory else 0] if class_names else None
+        event_class = getattr(watchdog_events, class_name, None) if class_name else None
+        if event_class is None:
+            return
+
+        src_path = self.directory if event.is_directory else os.path.join(self.directory, event.src_name)
+        if event.event_type == "moved":
+            self.handler.dispatch(event_class(src_path, os.path.join(self.directory, event.dest_name)))
+        else:
+            self.handler.dispatch(event_class(src_path))
+
+    def run(self, trace, speed, max_gap):
+        start_time = time.monotonic()
+        offset = 0.0
+        previous_time = trace[0].time if trace else 0.0
+
+        for event in trace:
+            # Gaps longer than max_gap are shortened; nothing happens in them anyway
+            gap = event.time - previous_time
+            offset += min(gap, max_gap) if max_gap > 0 else gap
+            previous_time = event.time
+
+            if speed > 0:
+                delay = start_time + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.apply(event)
+            self.note_edit(event, time.time())
+            self.feed(event)
+
+# Assign the edits of every zone to the next push of the zone. Returns the latencies from the
+# first and from the last edit before a push and the number of edits which never got pushed.
+def push_latencies(edits, pushes):
+    push_times = {}
+    for domain, push_time in pushes:
+        push_times.setdefault(domain, []).append(push_time)
+
+    from_first = []
+    from_last = []
+    unpushed = 0
+    for domain, edit_times in edits.items():
+        index = 0
+        for push_time in sorted(push_times.get(domain, [])):
+            burst = []
+            while index < len(edit_times) and edit_times[index] <= push_time:
+                burst.append(edit_times[index])
+                index += 1
+            # Several changes of one upload have no edits of their own
+            if burst:
+                from_first.append(push_time - burst[0])
+                from_last.append(push_time - burst[-1])
+        unpushed += len(edit_times) - index
+    return from_first, from_last, unpushed
+
+def run_replay(trace, speed, max_gap, workers, debounce, max_delay, mock_api):
+    directory = tempfile.mkdtemp(prefix="hetznerdns-replay-")
+    try:
+        db_manager = DBManager(os.path.join(directory, "replay.sqlite"))
+        db_manager.create_table()
+        hetzner_dns = HetznerDNS("replay", pool_size=workers, max_retries=3, backoff_factor=0.05,
+                                 rate_limiter=RateLimiter(10000, 10000), api_url=mock_api.url)
+        handler = ObserverHandler(db_manager, hetzner_dns, directory, debounce_seconds=debounce,
+                                  max_delay=max_delay, workers=workers)
+        replay = Replay(directory, handler)
+        handler.scheduler.start()
+
+        # The zones which existed before the trace are synchronized first and not counted
+        for file_name in existing_files(trace):
+            replay.write_file(file_name)
+        handler.check_4_changes()
+        handler.scheduler.wait_idle()
+
+        mock_api.reset_stats()
+        db_changes = db_manager.conn.total_changes
+        start_time = time.monotonic()
+        replay.run(trace, speed, max_gap)
+        handler.scheduler.wait_idle()
+        replay_time = time.monotonic() - start_time
+
+        db_writes = db_manager.conn.total_changes - db_changes
+        calls = dict(mock_api.calls)
+        from_first, from_last, unpushed = push_latencies(replay.edits, list(mock_api.pushes))
+
+        handler.scheduler.stop()
+        handler.scheduler.join()
+        hetzner_dns.close()
+        db_manager.close()
+
+        return {
+            "events": len(trace),
+            "edits": sum(len(edit_times) for edit_times in replay.edits.values()),
+            "zones": len(replay.edits),
+            "seconds": replay_time,
+            "calls": calls,
+            "db_writes": db_writes,
+            "pushes": len(from_last),
+            "unpushed": unpushed,
+            "first_p50": percentile(from_first, 0.50),
+            "first_p95": percentile(from_first, 0.95),
+            "last_p50": percentile(from_last, 0.50),
+            "last_p95": percentile(from_last, 0.95),
+            "last_max": max(from_last) if from_last else 0.0
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay an event trace of the daemon against the local mock Hetzner DNS API")
+    parser.add_argument("trace", help="event trace written with \"eventTrace\" in config.json")
+    parser.add_argument("--directory", default="", help="only replay the events of this watched directory")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 for real time, 0 without pauses")
+    parser.add_argument("--max-gap", type=float, default=0.0, help="shorten quiet gaps of the trace to this many seconds, 0 for off")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--debounce", type=float, default=2.0, help="quiet window of the scheduler in seconds")
+    parser.add_argument("--max-delay", type=float, default=30.0, help="longest delay of a zone which is written continuously")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency of the mock API in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing mock API requests")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    trace = read_trace(args.trace, args.directory)
+    if not trace:
+        print("The trace contains no events")
+        sys.exit(1)
+
+    mock_api = MockHetznerAPI(latency=args.latency, error_rate=args.error_rate)
+    mock_api.start()
+    try:
+        result = run_replay(trace, args.speed, args.max_gap, args.workers, args.debounce, args.max_delay, mock_api)
+    finally:
+        mock_api.stop()
+
+    print(f"Replayed {result['events']} events with {result['edits']} edits of {result['zones']} zones in {result['seconds']:.1f}s")
+    print(f"API calls: {sum(result['calls'].values())}")
+    for endpoint, count in sorted(result['calls'].items()):
+        print(f"  {endpoint:<40} {count:>6}")
+    print(f"DB writes: {result['db_writes']}")
+    print(f"Pushes: {result['pushes']} ({result['edits'] / result['pushes'] if result['pushes'] else 0.0:.1f} edits per push), "
+          f"edits never pushed: {result['unpushed']}")
+    print(f"Latency from the first edit: p50 {result['first_p50'] * 1000:.0f} ms, p95 {result['first_p95'] * 1000:.0f} ms")
+    print(f"Latency from the last edit:  p50 {result['last_p50'] * 1000:.0f} ms, p95 {result['last_p95'] * 1000:.0f} ms, "
+          f"max {result['last_max'] * 1000:.0f} ms")
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+__author__     = "Mia Sophie Behrendt"
+__copyright__  = "Copyright 2023, Maker-Hub.de"
+__license__    = "GPL"
+__version__    = "1.0.0"
+__maintainer__ = "Maker-Hub-De"
+__email__      = "github@maker-hub.de"
+__status__     = "Development"
+__date__       = "12.10.2023"
+
+# Summarise the trace log of the daemon ("traceLog" in config.json) into p50/p95/p99 per stage
+#   python3 tools/trace_summary.py /usr/local/bin/hetznerdns/trace.jsonl [--zone example.com.db] [--since 3600]
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+# Make the modules of the daemon available when started from the tools directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.tracing import percentile
+
+STAGES = ["detect", "debounce", "zone_id", "upload", "db", "total"]
+
+def read_spans(file_names, zone=None, since=None):
+    for file_name in file_names:
+        with open(file_name, 'r') as trace_file:
+            for line in trace_file:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                if zone and span.get("zone") != zone:
+                    continue
+                if since and span.get("time", 0) < since:
+                    continue
+                yield span
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the trace log of hetznerDnsUpdate.py")
+    parser.add_argument("files", nargs="+", help="trace log files")
+    parser.add_argument("--zone", help="only spans of this zone file")
+    parser.add_argument("--since", type=float, help="only spans of the last N seconds")
+    args = parser.parse_args()
+
+    since = time.time() - args.since if args.since else None
+    timings = {stage: [] for stage in STAGES}
+    outcomes = Counter()
+    count = 0
+
+    for span in read_spans(args.files, args.zone, since):
+        count += 1
+        outcomes[span.get("outcome")] += 1
+        for stage, seconds in (span.get("stages") or {}).items():
+            timings.setdefault(stage, []).append(seconds)
+        timings["total"].append(span.get("total", 0.0))
+
+    if not count:
+        print("No spans found")
+        sys.exit(0)
+
+    print(f"{count} spans: " + ", ".join(f"{outcome} {number}" for outcome, number in outcomes.most_common()))
+    print(f"{'stage':<10} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for stage, values in timings.items():
+        if not values:
+            continue
+        print(f"{stage:<10} {len(values):>7} {percentile(values, 0.50) * 1000:>10.1f} {percentile(values, 0.95) * 1000:>10.1f} "
+              f"{percentile(values, 0.99) * 1000:>10.1f} {max(values) * 1000:>10.1f}")